@@ -0,0 +1,237 @@
+"""
+Offline benchmarks of every stage of serving a prediction, on synthetic databases
+(see synthetic.py) and a fake weather provider in place of OpenWeatherMap, so
+they need neither the real data nor network access.
+
+    python bench.py [--sizes 10000,100000] [--repeat 5] [--output bench.json]
+
+Results are written as JSON: one entry per stage and database size with the
+median and best time in seconds.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from classifier import Classifier, InputData, build_features
+import db
+import responses
+from store import ModelDataStore
+import synthetic
+import utils
+import weather as wt
+
+
+class FakeWeather:
+    """Stands in for a pyowm Weather object, with fixed values"""
+
+    humidity = 60
+    rain = {"1h": 0.1}
+
+    def temperature(self, unit: str = "kelvin") -> dict:
+        return {"temp": 68.0}
+
+    def barometric_pressure(self, unit: str = "hPa") -> dict:
+        return {"press": 1012}
+
+    def wind(self, unit: str = "meters_sec") -> dict:
+        return {"speed": 5.0}
+
+
+class FakeWeatherManager:
+    """Stands in for `weather.owm_mgr`, answers every query with `FakeWeather`"""
+
+    class _Observation:
+        weather = FakeWeather()
+
+    class _OneCall:
+        current = FakeWeather()
+
+    class _Forecaster:
+        class forecast:
+            weathers = [FakeWeather()]
+
+    def weather_at_zip_code(self, zip_code: str, country: str = "US"):
+        return self._Observation()
+
+    def one_call(self, lat: float, lon: float):
+        return self._OneCall()
+
+    def forecast_at_id(self, id: int, interval: str = "3h", limit: int = None):
+        return self._Forecaster()
+
+
+def timeit(fn, repeat: int = 5) -> tuple:
+    """Calls `fn` `repeat` times, returns the times in seconds and the last result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def bench_size(path: str, rows: int, classifier: Classifier, repeat: int = 5) -> list:
+    """Times every stage on the database at `path`, returns one result per stage"""
+    results = []
+
+    def record(stage: str, fn, n: int = rows):
+        times, result = timeit(fn, repeat)
+        results.append(
+            {
+                "stage": stage,
+                "rows": n,
+                "repeat": repeat,
+                "median_s": statistics.median(times),
+                "min_s": min(times),
+                "rows_per_s": n / statistics.median(times) if n else None,
+            }
+        )
+        return result
+
+    conn = utils.connect_to_db(path, debug=False)
+    dict_conn = utils.connect_to_db(path, debug=True)
+    zip_code = conn.execute(
+        "SELECT Zip_Code FROM model_data GROUP BY Zip_Code ORDER BY COUNT(*) DESC LIMIT 1;"
+    ).fetchone()[0]
+    zip_rows = conn.execute(
+        "SELECT COUNT(*) FROM model_data WHERE Zip_Code = ?;", [zip_code]
+    ).fetchone()[0]
+
+    # the original, DataFrame-based path
+    record("sql_fetch", lambda: utils.get_all_model_data(conn, sample=False))
+    pool = db.ConnectionPool(path)
+    record(
+        "sql_fetch_pool_arrays",
+        lambda: pool.arrays(f"SELECT {', '.join(db.MODEL_DATA_COLUMNS)} FROM model_data;"),
+    )
+    records = record(
+        "sql_fetch_dict_factory", lambda: utils.get_all_model_data(dict_conn, sample=False)
+    )
+    location = record("dataframe", lambda: pd.DataFrame(records))
+
+    def weather_lookup():
+        wt.weather_cache.clear()  # time the lookup, not the cache
+        return wt.get_weather_by_zip(zip_code, type_="tuple")
+
+    weather = record("weather_lookup", weather_lookup, n=1)
+
+    def input_data():
+        frame = location.copy()
+        frame[wt.COLUMNS] = weather
+        frame["Start_Time"] = datetime.now()
+        return InputData(data=frame)
+
+    idata = record("input_data", input_data)
+    output = record(
+        "classifier_predict",
+        lambda: classifier.predict(idata.data_ohe, idata.index, type_="pd"),
+    )
+    record("to_dict", lambda: output.to_dict("records"))
+    by_zip = record(
+        "zip_query",
+        lambda: utils.get_model_data_by_zip(dict_conn, zip_code),
+        n=zip_rows,
+    )
+    record(
+        "zip_query_pool",
+        lambda: pool.execute(db.MODEL_DATA_BY_ZIP_QUERY, [zip_code]),
+        n=zip_rows,
+    )
+    record(
+        "make_prediction_zip",
+        lambda: utils.make_prediction(pd.DataFrame(by_zip), weather, classifier),
+        n=zip_rows,
+    )
+    location_query = (34.05, -118.25)
+    record(
+        "get_closest_match_scan",
+        lambda: utils.get_closest_match(dict_conn, location_query),
+        n=1,
+    )
+
+    # the in-memory, array-based path
+    store = record("store_load", lambda: ModelDataStore(path), n=rows)
+    data = store.data
+    record(
+        "get_closest_match_index",
+        lambda: utils.get_closest_match(
+            conn, location_query, index=data.spatial_index, data=data.frame()
+        ),
+        n=1,
+    )
+    record("nearest", lambda: data.nearest(location_query), n=1)
+    columns = data.columns()
+    features = record(
+        "build_features",
+        lambda: build_features(*columns, weather, datetime.now()),
+    )
+    labels, probabilities = record("score", lambda: classifier.score(features))
+    prediction = {
+        "time": datetime.now(),
+        "lat": data.lat,
+        "lon": data.lon,
+        "label": labels,
+        "probability": probabilities,
+    }
+    weather_dict = dict(zip(wt.COLUMNS, weather))
+    for fmt in ["json", "columns"]:
+        record(f"render_{fmt}", lambda: responses.render(fmt, prediction, weather_dict))
+
+    conn.close()
+    dict_conn.close()
+    pool.close()
+    return results
+
+
+def run(sizes: list, repeat: int = 5, engine: str = "xgboost", workdir: str = None) -> dict:
+    """Runs the benchmarks for every database size, returns the results"""
+    wt.owm_mgr = FakeWeatherManager()
+    wt.weather_cache.clear()
+    classifier = Classifier.load_model("model.json", engine=engine)
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for rows in sizes:
+            path = synthetic.make_db(os.path.join(tmp, f"bench-{rows}.db"), rows=rows)
+            for result in bench_size(path, rows, classifier, repeat):
+                results.append({"size": rows, **result})
+                print(
+                    f"{rows:>9} {result['stage']:<26} "
+                    f"{result['median_s'] * 1000:>10.2f} ms"
+                )
+    meta = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "engine": engine,
+        "repeat": repeat,
+    }
+    if engine == "xgboost":
+        # imported here, the numpy engine is meant for installs without XGBoost
+        import xgboost
+
+        meta["xgboost"] = xgboost.__version__
+    return {"meta": meta, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", default="10000,100000", help="comma-separated numbers of rows"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--engine", default="xgboost", choices=["xgboost", "numpy"])
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args()
+    report = run([int(n) for n in args.sizes.split(",")], args.repeat, args.engine)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
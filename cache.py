@@ -0,0 +1,183 @@
+"""
+Bounded, time-limited caches used to avoid repeating expensive calls (e.g. calls
+to the OpenWeatherMap API) for the same key.
+"""
+import asyncio
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+_MISSING = object()
+
+
+class _Call:
+    """An in-flight computation that other callers for the same key wait on"""
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # the callers that were waiting may all have been cancelled by then
+    if not task.cancelled():
+        task.exception()
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire `ttl` seconds after being stored. Concurrent
+    misses for the same key are de-duplicated (single-flight): only the first
+    caller computes the value, the others wait for and share its result. Works
+    from both threads (`get_or_compute`) and coroutines (`aget_or_compute`).
+
+    Arguments
+    ---------
+    ttl (float): number of seconds an entry stays valid
+    maxsize (int): maximum number of entries, the least recently used entry is
+    evicted once the cache is full
+    """
+
+    def __init__(self, ttl: float = 3600, maxsize: int = 1000) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._in_flight = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for `key`, or `default` if missing or expired"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for `key`, calling `compute()` to fill the cache
+        on a miss. If another thread is already computing the value for `key` this
+        waits for it instead of calling `compute()` again.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            with self._lock:
+                self._store(key, call.value)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.event.set()
+        return call.value
+
+    async def aget_or_compute(
+        self, key: Hashable, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Coroutine version of `get_or_compute`: awaits `compute()` on a miss, other
+        coroutines missing on the same key await the same result. `compute()` runs
+        in a task of its own, so a caller that is cancelled (e.g. because its
+        client disconnected) stops waiting without cancelling it for the others.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            task = self._pending.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fill(key, compute))
+                task.add_done_callback(_retrieve_exception)
+                self._pending[key] = task
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            with self._lock:
+                self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the current size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+    def _lookup(self, key: Hashable) -> Any:
+        # must be called with the lock held
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        # must be called with the lock held
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
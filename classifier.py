@@ -2,11 +2,15 @@
 Used to classify locations as being an area of high-probability of accidents (1)
 or not (0). Adapted from prediction.py
 """
+from datetime import datetime
 from os import PathLike
 from typing import Union
 
+import numpy as np
 import pandas as pd
-from xgboost import XGBClassifier
+
+import metrics
+from trees import TreeEnsemble
 
 
 SELECTED_FEATURES = [
@@ -31,6 +35,8 @@ SELECTED_FEATURES = [
     "Start_Day_5",
     "Start_Day_6",
 ]
+WEATHER_FEATURES = SELECTED_FEATURES[2:7]
+FLAG_FEATURES = SELECTED_FEATURES[7:11]
 
 
 class Data:
@@ -103,15 +109,86 @@ class InputData(Data):
         return self._data_ohe
 
 
+def build_features(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    flags: dict,
+    weather: tuple,
+    when: datetime,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Builds the model input for the given locations at the given time, without
+    going through `InputData`. Writes directly into a float32 matrix whose
+    columns are in `SELECTED_FEATURES` order; the result is identical to
+    `InputData(data=...).data_ohe` as the model sees it.
+
+    Args
+    ----
+    lat (np.ndarray): latitude of each location
+    lon (np.ndarray): longitude of each location
+    flags (dict): maps each of `FLAG_FEATURES` to an array of 0/1 (or bool) values
+    weather (tuple): values of `WEATHER_FEATURES`, shared by every location, or an
+    array with one row of values per location
+    when (datetime): the time the prediction is for, or a datetime64 array with
+    one time per location
+    out (np.ndarray): optional preallocated (n, 20) float32 matrix to write into
+
+    Returns
+    -------
+    (np.ndarray) the (n, 20) float32 feature matrix
+    """
+    n = len(lat)
+    if out is None:
+        out = np.empty((n, len(SELECTED_FEATURES)), dtype=np.float32)
+    out[:, 0] = lat
+    out[:, 1] = lon
+    out[:, 2:7] = weather
+    for i, name in enumerate(FLAG_FEATURES, start=7):
+        out[:, i] = flags[name]
+    month, hour, day = _time_features(when)
+    out[:, 11] = month
+    out[:, 12] = hour
+    out[:, 13:] = 0
+    out[np.arange(n), 13 + day] = 1
+    return out
+
+
+def _time_features(when) -> tuple:
+    """
+    Returns the month (1-12), hour and day of the week (Monday is 0) of a
+    datetime, or of each time in a datetime64 array
+    """
+    if isinstance(when, datetime):
+        return when.month, when.hour, when.weekday()
+    when = np.asarray(when, dtype="datetime64[s]")
+    days = when.astype("datetime64[D]")
+    month = when.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    hour = (when - days).astype("timedelta64[h]").astype(np.int64)
+    # 1970-01-01 was a Thursday
+    day = (days.astype(np.int64) + 3) % 7
+    return month, hour, day
+
+
 class Classifier:
     def __init__(
         self, features: pd.DataFrame = None, target: pd.DataFrame = None, **kwargs
     ) -> None:
-        self._classifier = XGBClassifier(**kwargs)
+        self._kwargs = kwargs
+        self._xgb = None
+        self._engine = None
         self._current_prediction = None
         self._features = features
         self._target = target
 
+    @property
+    def _classifier(self):
+        # XGBoost (and scikit-learn with it) takes about a second to import, so
+        # it is only imported once an XGBoost model is needed
+        if self._xgb is None:
+            self._xgb = _import_xgb_classifier()(**self._kwargs)
+        return self._xgb
+
     def fit(self) -> "Classifier":
         features = self._features
         target = self._target
@@ -121,10 +198,15 @@ class Classifier:
     def predict(
         self, data: pd.DataFrame, index: pd.DataFrame, type_: str = "dict"
     ) -> pd.DataFrame:
-        prediction = self._classifier.predict(data)
+        # a single pass over the trees, labels are derived from the probabilities
+        # the same way XGBClassifier.predict does
+        with metrics.span("predict"):
+            if self._engine is not None:
+                proba = self._engine.predict_proba(np.asarray(data, dtype=np.float32))
+            else:
+                proba = self._classifier.predict_proba(data)[:, 1]
         output = index.copy()
-        output["label"] = prediction
-        proba = self._classifier.predict_proba(data)[:, 1]
+        output["label"] = (proba > 0.5).astype(int)
         output["probability"] = proba
         output = output.rename(
             columns={"Start_Lat": "lat", "Start_Lng": "lon", "Start_Time": "time"}
@@ -139,6 +221,30 @@ class Classifier:
         else:
             raise ValueError(f"'type_' must be either 'pd' or 'dict' not {type_}")
 
+    def score(self, data: np.ndarray, threshold: float = 0.5) -> tuple:
+        """
+        Runs the model once over a feature matrix (e.g. from `build_features`) and
+        returns the labels and probabilities as arrays, without building a
+        DataFrame.
+
+        Args
+        ----
+        data (np.ndarray): (n, 20) feature matrix in `SELECTED_FEATURES` order
+        threshold (float): locations whose probability is above this are labelled 1
+
+        Returns
+        -------
+        (tuple) uint8 array of labels and float32 array of probabilities
+        """
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        with metrics.span("predict"):
+            if self._engine is not None:
+                proba = self._engine.predict_proba(data)
+            else:
+                # (0, 0) rather than (0,) for an empty matrix
+                proba = self._classifier.get_booster().inplace_predict(data).reshape(-1)
+        return (proba > threshold).astype(np.uint8), proba
+
     @property
     def feature_names(self) -> list:
         """
@@ -147,9 +253,23 @@ class Classifier:
         return list(self._classifier.feature_names_in_)
 
     @staticmethod
-    def load_model(path: Union[str, PathLike] = "model.json") -> "Classifier":
+    def load_model(
+        path: Union[str, PathLike] = "model.json", engine: str = "xgboost"
+    ) -> "Classifier":
+        """
+        Loads a saved model. With `engine="numpy"` the trees are evaluated by
+        `trees.TreeEnsemble` instead of XGBoost (only prediction is supported, and
+        the model must be in JSON format, or an .npz saved by `TreeEnsemble.save`).
+        """
         classifier = Classifier()
-        classifier._classifier.load_model(path)
+        if engine == "numpy" and str(path).endswith(".npz"):
+            classifier._engine = TreeEnsemble.load(path)
+        elif engine == "numpy":
+            classifier._engine = TreeEnsemble.from_json(path)
+        elif engine == "xgboost":
+            classifier._classifier.load_model(path)
+        else:
+            raise ValueError(f"'engine' must be either 'xgboost' or 'numpy' not {engine}")
 
         return classifier
 
@@ -160,6 +280,17 @@ class Classifier:
         self._current_prediction.to_csv(path, index=False)
 
 
+def _import_xgb_classifier():
+    try:
+        from xgboost import XGBClassifier
+    except ImportError as e:
+        raise ImportError(
+            "XGBoost isn't installed; install it or serve with engine=\"numpy\" "
+            "(MODEL_ENGINE=numpy), which doesn't need it"
+        ) from e
+    return XGBClassifier
+
+
 def _get_time_data(data: pd.DataFrame, dropcol=True) -> list:
     """
     Extracts the hour, day, and month of week from the `Start_Time` column
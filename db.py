@@ -0,0 +1,164 @@
+"""
+Read-only access to locations.db: tuned, read-only connections (one per thread
+with `ConnectionPool`, so concurrent readers don't serialize on one shared
+handle) whose rows come back as tuples or NumPy columns instead of dicts, and the
+queries run on them. WAL is switched on by `maintenance.py migrate`, these
+connections never write to the file.
+"""
+import sqlite3
+import threading
+from urllib.parse import quote
+
+import numpy as np
+
+
+MODEL_DATA_COLUMNS = [
+    "Start_Lat",
+    "Start_Lng",
+    "Amenity",
+    "Bump",
+    "Crossing",
+    "Give_Way",
+    "Junction",
+    "No_Exit",
+    "Railway",
+    "Roundabout",
+    "Station",
+    "Stop",
+    "Traffic_Calming",
+    "Traffic_Signal",
+    "Turning_Loop",
+    "Zip_Code",
+]
+
+# rows with a NULL in any of these columns can't be scored and are left out, as
+# the `dropna` of the original pandas pipeline did
+COMPLETE_ROWS = " AND ".join(f"{column} IS NOT NULL" for column in MODEL_DATA_COLUMNS)
+
+# lookups by zip code, for readers that query the database directly (the API
+# serves from the in-memory copy in store.py, which reads the whole table);
+# `maintenance.py check` makes sure the schema answers them without a full scan
+MODEL_DATA_BY_ZIP_QUERY = (
+    f"SELECT {', '.join(MODEL_DATA_COLUMNS)} FROM model_data WHERE Zip_Code = ?;"
+)
+ZIP_CODE_EXISTS_QUERY = "SELECT 1 FROM zip_codes WHERE zip_code = ?;"
+
+# statements each connection keeps compiled; the queries are fixed strings, so
+# every query after the first on a connection reuses its prepared statement
+CACHED_STATEMENTS = 256
+MMAP_SIZE = 256 * 1024 * 1024  # bytes
+CACHE_SIZE = -64 * 1024  # negative -> in KiB, i.e. 64MiB
+
+
+def connect(
+    path: str = "locations.db", mmap_size: int = MMAP_SIZE, cache_size: int = CACHE_SIZE
+) -> sqlite3.Connection:
+    """
+    Opens a read-only connection to the given database with memory-mapped I/O and
+    a larger page cache. Rows are plain tuples.
+
+    Arguments
+    ---------
+    path (str): path to the database
+    mmap_size (int): number of bytes of the database file to memory-map
+    cache_size (int): page cache size (pages, or KiB if negative)
+
+    Returns
+    -------
+    (sqlite3.Connection) the connection
+    """
+    conn = sqlite3.connect(
+        f"file:{quote(path)}?mode=ro",
+        uri=True,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,  # only used by one thread at a time, see ConnectionPool
+        isolation_level=None,  # reads only, no implicit transactions
+    )
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)};")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
+
+def tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """
+    Returns a cursor of `conn` whose rows are plain tuples, whatever row factory
+    the connection uses (e.g. the dict rows of `utils.connect_to_db`)
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def arrays(conn: sqlite3.Connection, query: str, params=(), dtypes: list = None) -> list:
+    """
+    Runs a query and returns its result column by column, as NumPy arrays
+
+    Arguments
+    ---------
+    conn (sqlite3.Connection): connection to the database
+    query (str): the query
+    params: the query parameters
+    dtypes (list): dtype of each column (inferred if not given)
+
+    Returns
+    -------
+    list of arrays, one per column of the query
+    """
+    cursor = tuple_cursor(conn).execute(query, params)
+    rows = cursor.fetchall()
+    n_columns = len(cursor.description)
+    columns = list(zip(*rows)) if rows else [()] * n_columns
+    del rows
+    dtypes = dtypes or [None] * n_columns
+    return [np.array(col, dtype=dtype) for col, dtype in zip(columns, dtypes)]
+
+
+class ConnectionPool:
+    """
+    Hands out one read-only connection (see `connect`) per thread, opened the
+    first time the thread asks for one.
+
+    Arguments
+    ---------
+    path (str): path to the database
+    pragmas: passed on to `connect`
+    """
+
+    def __init__(self, path: str = "locations.db", **pragmas) -> None:
+        self.path = path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, **self.pragmas)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def execute(self, query: str, params=()) -> list:
+        """Runs a query on the calling thread's connection, returns a list of tuples"""
+        return self.connection().execute(query, params).fetchall()
+
+    def arrays(self, query: str, params=(), dtypes: list = None) -> list:
+        """Runs a query on the calling thread's connection, see `arrays`"""
+        return arrays(self.connection(), query, params, dtypes)
+
+    def close(self) -> None:
+        """Closes every connection the pool opened"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
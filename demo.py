@@ -1,4 +1,4 @@
-from models import Classifier, InputData, TrainingData
+from classifier import Classifier, InputData, TrainingData
 
 
 tdata = TrainingData("la_final_data.csv")
@@ -0,0 +1,137 @@
+"""
+Load generator for a running server. Sends requests to the prediction endpoints
+from `concurrency` concurrent clients for `duration` seconds and reports the
+throughput and latency percentiles of each endpoint.
+
+    python loadtest.py [--url http://localhost:8000] [--concurrency 16]
+                       [--duration 30] [--endpoints zip,coords,all]
+                       [--output loadtest.json]
+
+Run the server against owm_stub.py (see there) to load-test without calling the
+real OpenWeatherMap API.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+import numpy as np
+
+from synthetic import LAT_RANGE, LON_RANGE
+
+
+ENDPOINTS = ["zip", "coords", "all"]
+
+
+def make_request(endpoint: str, zip_codes: list, rng: random.Random) -> str:
+    """Returns the path (and query) of a random request to the given endpoint"""
+    if endpoint == "zip":
+        return f"/predict/zip/{rng.choice(zip_codes)}"
+    if endpoint == "coords":
+        lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+        return f"/predict/coords/?lat={lat:.5f}&lon={lon:.5f}"
+    if endpoint == "all":
+        return "/predict/all?format=columns"
+    raise ValueError(f"endpoint must be one of {', '.join(ENDPOINTS)}, not '{endpoint}'")
+
+
+async def run(
+    url: str = "http://localhost:8000",
+    concurrency: int = 16,
+    duration: float = 30,
+    endpoints: list = ENDPOINTS,
+    timeout: float = 60,
+    seed: int = 0,
+) -> dict:
+    """
+    Runs the load test, returns a report with one entry per endpoint
+
+    Arguments
+    ---------
+    url (str): root URL of the server
+    concurrency (int): number of requests in flight at once
+    duration (float): how long to send requests for, in seconds
+    endpoints (list): which of `ENDPOINTS` to call (in turn)
+    timeout (float): seconds to wait for a response before counting it as an error
+    seed (int): seed of the random zip codes and coordinates
+    """
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        zip_codes = (await client.get("/zip_codes")).json()
+        latencies = {endpoint: [] for endpoint in endpoints}
+        errors = {endpoint: 0 for endpoint in endpoints}
+        deadline = time.perf_counter() + duration
+
+        async def worker(i: int):
+            rng = random.Random(seed + i)
+            n = i
+            while time.perf_counter() < deadline:
+                endpoint = endpoints[n % len(endpoints)]
+                n += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(make_request(endpoint, zip_codes, rng))
+                    await response.aread()
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[endpoint].append(time.perf_counter() - start)
+                else:
+                    errors[endpoint] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    results = []
+    for endpoint in endpoints:
+        times = np.array(latencies[endpoint])
+        p50, p95, p99 = np.percentile(times, [50, 95, 99]) if len(times) else [None] * 3
+        results.append(
+            {
+                "endpoint": endpoint,
+                "requests": len(times) + errors[endpoint],
+                "errors": errors[endpoint],
+                "throughput_rps": len(times) / elapsed,
+                "p50_ms": p50 * 1000 if p50 is not None else None,
+                "p95_ms": p95 * 1000 if p95 is not None else None,
+                "p99_ms": p99 * 1000 if p99 is not None else None,
+            }
+        )
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "results": results,
+    }
+
+
+def _format(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the prediction endpoints")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--output", default=None, help="also write the report as JSON")
+    args = parser.parse_args()
+    report = asyncio.run(
+        run(args.url, args.concurrency, args.duration, args.endpoints.split(","))
+    )
+    print(f"{'endpoint':<8} {'requests':>8} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in report["results"]:
+        print(
+            f"{r['endpoint']:<8} {r['requests']:>8} {r['errors']:>6} "
+            f"{_format(r['throughput_rps']):>8} {_format(r['p50_ms']):>8} "
+            f"{_format(r['p95_ms']):>8} {_format(r['p99_ms']):>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
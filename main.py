@@ -1,13 +1,43 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+import os
+import time
+import traceback
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import numpy as np
+from pydantic import BaseModel
+from starlette.routing import Match
 
-from classifier import Classifier, InputData
+from cache import TTLCache
+from classifier import InputData
+import metrics
+from registry import ModelRegistry, ModelVersion
+import responses
+import sampling
+from snapshots import SnapshotScheduler
+from store import ModelDataStore
+import tiles
 import utils
 import weather as wt
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # requests are accepted while the model and the model data load, see /ready
+    task = asyncio.create_task(start_up())
+    yield
+    task.cancel()
+    await scheduler.stop()
+    await models.stop()
+    await wt.async_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost",
     "https://localhost:5500",
@@ -22,63 +52,604 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-classifier = Classifier.load_model(path="model.json")
+# locations whose predicted probability is above this are labelled high-risk (1)
+THRESHOLD = float(os.environ.get("PREDICTION_THRESHOLD", 0.5))
+
+# most coordinates POST /predict/coords/ scores in one request
+BATCH_LIMIT = int(os.environ.get("BATCH_LIMIT", 10000))
+
+# requests with an `X-Profile: 1` header are answered with a profile of the
+# request instead when this is set, see profile_request
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+
+# weather the bulk prediction endpoints can use, see _row_weather
+WEATHER_MODES = ["city", "zip", "grid"]
+
+# live predictions per zip code, weather bucket and hour (see utils.prediction_key)
+prediction_cache = TTLCache(
+    ttl=float(os.environ.get("PREDICTION_CACHE_TTL", 3600)),
+    maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 1000)),
+)
+
+# the served model: the latest version in MODEL_DIR (model.json if it has none),
+# checked for every MODEL_POLL_INTERVAL seconds and swapped in without a restart.
+# Handlers read `models.active` once, so a request uses a single version, which is
+# reported in the X-Model-Version header
+models = ModelRegistry(
+    directory=os.environ.get("MODEL_DIR", "models"),
+    engine=os.environ.get("MODEL_ENGINE", "xgboost"),
+    poll=float(os.environ.get("MODEL_POLL_INTERVAL", 30)),
+    on_swap=lambda model: prediction_cache.clear(),
+    cache_dir=os.environ.get("MODEL_CACHE_DIR", ".model_cache"),
+)
+
+# every model data point, held in memory (and spatially indexed) for the handlers
+store = ModelDataStore("locations.db", load=False)
+
+# predictions for all the model data are recomputed in the background this often
+# (in seconds, 0 to disable) and served from memory
+scheduler = SnapshotScheduler(
+    store,
+    models,
+    interval=float(os.environ.get("SNAPSHOT_INTERVAL", 600)),
+    threshold=THRESHOLD,
+)
+
+
+# `status` is starting, ready or failed (with the reason in `error`), `seconds`
+# is how long each part of starting up took
+startup = {"status": "starting", "error": None, "seconds": {}}
+# endpoints that are served before the server is ready
+STARTUP_ENDPOINTS = {"/ready", "/metrics", "/docs", "/openapi.json"}
+
+
+async def start_up():
+    """
+    Loads the model and the model data, each in a thread so they (and the slow
+    imports they need, XGBoost and scikit-learn) run in parallel, then starts the
+    background tasks
+    """
+
+    async def timed(name: str, fn):
+        start = time.perf_counter()
+        await asyncio.to_thread(fn)
+        startup["seconds"][name] = time.perf_counter() - start
+        metrics.startup_seconds.set(startup["seconds"][name], stage=name)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(timed("model", models.refresh), timed("data", store.reload))
+    except Exception as e:
+        traceback.print_exc()
+        startup["status"], startup["error"] = "failed", str(e).splitlines()[0]
+        return
+    startup["seconds"]["total"] = time.perf_counter() - start
+    metrics.startup_seconds.set(startup["seconds"]["total"], stage="total")
+    startup["status"] = "ready"
+    models.start()
+    if scheduler.interval > 0:
+        scheduler.start()
+
 
-conn = utils.connect_to_db()
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    if startup["status"] != "ready" and request.url.path not in STARTUP_ENDPOINTS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"server is {startup['status']}"},
+            headers={"Retry-After": "1"},
+        )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """
+    Times every request (see metrics.py), labelled with the path of the route it
+    matched rather than the actual path so zip codes etc. don't each get their
+    own series
+    """
+    endpoint = _route_path(request)
+    token = metrics.current_endpoint.set(endpoint)
+    start = time.perf_counter()
+    try:
+        if PROFILING and request.headers.get("x-profile") == "1":
+            return await profile_request(request, call_next)
+        response = await call_next(request)
+    finally:
+        metrics.current_endpoint.reset(token)
+    metrics.request_seconds.observe(
+        time.perf_counter() - start,
+        endpoint=endpoint,
+        method=request.method,
+        status=response.status_code,
+    )
+    size = response.headers.get("content-length")
+    if size is not None:
+        metrics.response_bytes.observe(int(size), endpoint=endpoint)
+    return response
+
+
+async def profile_request(request: Request, call_next) -> Response:
+    """
+    Handles the request under the profiler (see metrics.profile) and returns the
+    profile as text instead of the response. The status of the actual response is
+    in the X-Profiled-Status header. Answers 409 while another request is being
+    profiled.
+    """
+    try:
+        with metrics.profile() as report:
+            response = await call_next(request)
+            # streamed responses do most of their work while the body is sent
+            async for _ in response.body_iterator:
+                pass
+    except metrics.ProfilerBusy as e:
+        return JSONResponse(status_code=409, content={"detail": str(e)})
+    return PlainTextResponse(
+        report[0], headers={"X-Profiled-Status": str(response.status_code)}
+    )
+
+
+@app.exception_handler(wt.WeatherError)
+async def weather_error_handler(request: Request, exc: wt.WeatherError):
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
 
 
 @app.get("/")
-async def home():
+async def home(response: Response):
     # just serve the sample predictions for now
+    model = models.active
     data = InputData(path="sample_test_data.csv")
-    weather = wt.get_la_weather()
-    prediction = classifier.predict(data.data_ohe, data.index, "list")
+    weather = await wt.async_client.get_la_weather()
+    prediction = model.classifier.predict(data.data_ohe, data.index, "list")
+    response.headers["X-Model-Version"] = model.version
     return {"predictions": prediction, "weather": weather.to_dict("index")[0]}
 
 
 @app.get("/predict/zip/{zip_code}")
-async def predict_zip_code(zip_code: str):
-    zip_codes = utils.get_all_zip_codes(conn)
-    if zip_code not in zip_codes:
+async def predict_zip_code(
+    zip_code: str, request: Request, format: str = None, live: bool = False
+):
+    """
+    Predictions for every data point in the zip code. Served from the latest
+    background snapshot if there is one, unless `live` is true. Live predictions
+    are cached per weather bucket and hour (see `prediction_cache`).
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    model = models.active
+    loaded = store.loaded
+    if zip_code not in loaded.zip_code_set:
         raise HTTPException(status_code=404, detail=f"{zip_code} not found in database")
-    ls = utils.get_model_data_by_zip(conn, zip_code)
-    locations = None
-    if ls:
-        locations = pd.DataFrame(ls)
-    else:
+    data = loaded.data
+    rows = data.by_zip(zip_code)
+    if rows is None:
         raise HTTPException(status_code=404, detail=f"Nothing found for {zip_code}")
-    cols = list(locations.columns)
-    if not 'Start_Lat' in cols and 'Start_Lng' in cols:
-        print(zip_code)
-        raise HTTPException(status_code=404, detail=f"{zip_code} failed")
-    weather = wt.get_weather_by_zip(zip_code)
-    w_tuple = tuple(weather.values[0])
-    prediction = utils.make_prediction(locations, w_tuple, classifier)
-    [p.update({"zip_code": zip_code}) for p in prediction]
-    return {"predictions": prediction, "weather": weather.to_dict("index")[0]}
+
+    snapshot = None if live else scheduler.current(data, model)
+    if snapshot is not None and zip_code in snapshot.zip_weather:
+        weather = snapshot.zip_weather[zip_code]
+        prediction = snapshot.predictions(rows, by_zip=True)
+    else:
+        snapshot = None
+        observed = await wt.async_client.get_weather_by_zip(zip_code, type_="tuple")
+        when = datetime.now()
+        location = ("zip", zip_code, model.version, model.mtime)
+        key = utils.prediction_key(location, observed, when)
+        # entries keep the weather they were scored with, which is within a
+        # rounding step of `observed`, so the response shows the model's inputs
+        weather, prediction = prediction_cache.get_or_compute(
+            key,
+            lambda: (
+                observed,
+                utils.predict_locations(
+                    *data.columns(rows),
+                    observed,
+                    model.classifier,
+                    when=when,
+                    threshold=THRESHOLD,
+                ),
+            ),
+        )
+        prediction = {**prediction, "time": when, "zip_code": zip_code}
+    metrics.record_rows(len(prediction["lat"]))
+    response = responses.render(fmt, prediction, dict(zip(wt.COLUMNS, weather)))
+    if snapshot is not None:
+        response.headers["X-Generated-At"] = snapshot.generated_at.isoformat()
+    return _versioned(response, model)
 
 
 @app.get("/predict/coords/")
-async def predict_by_coords(lat: float, lon: float):
-    closest = pd.DataFrame(utils.get_closest_match(conn, (lat, lon))[1], index=[0])
-    closest[["Start_Lat", "Start_Lng"]] = lat, lon
-    weather = wt.get_weather_by_lat_lon(lat, lon)
-    prediction = utils.make_prediction(closest, weather, classifier)
-    return {"predictions": prediction, "weather": weather.to_dict("index")[0]}
+async def predict_by_coords(lat: float, lon: float, response: Response):
+    model = models.active
+    data = store.data
+    _, rows = data.nearest((lat, lon))
+    _, _, flags = data.columns(rows)
+    weather = await wt.async_client.get_weather_by_lat_lon(lat, lon, type_="tuple")
+    prediction = utils.predict_locations(
+        [lat], [lon], flags, weather, model.classifier, threshold=THRESHOLD
+    )
+    _versioned(response, model)
+    return {
+        "predictions": utils.to_records(prediction),
+        "weather": dict(zip(wt.COLUMNS, weather)),
+    }
+
+
+class Coordinates(BaseModel):
+    lat: float
+    lon: float
+
+
+class CoordinatesBatch(BaseModel):
+    coordinates: List[Coordinates]
+
+
+@app.post("/predict/coords/")
+async def predict_by_coords_batch(
+    batch: CoordinatesBatch, request: Request, format: str = None
+):
+    """
+    Predictions for many latitude-longitude pairs at once. Each location uses the
+    flags of its closest data point (`distance`, in miles) and the weather of its
+    grid cell; `cell` is the position of that cell in `weather`. The weather is
+    fetched once per cell.
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    if not batch.coordinates:
+        raise HTTPException(status_code=422, detail="coordinates must not be empty")
+    if len(batch.coordinates) > BATCH_LIMIT:
+        raise HTTPException(
+            status_code=413,
+            detail=f"at most {BATCH_LIMIT} coordinates can be scored per request",
+        )
+    model = models.active
+    lat = np.array([c.lat for c in batch.coordinates], dtype=np.float64)
+    lon = np.array([c.lon for c in batch.coordinates], dtype=np.float64)
+    data = store.data
+    distance, rows = data.nearest_many(lat, lon)
+    _, _, flags = data.columns(rows)
+
+    cells, inverse = wt.grid_cells(lat, lon)
+    cell_weather = await wt.async_client.get_weather_by_cells(cells)
+    if len(cell_weather) < len(cells):
+        # same weather /predict/all uses for cells it couldn't get the weather of
+        city_weather = await wt.async_client.get_la_weather(type_="tuple")
+        cell_weather = {cell: cell_weather.get(cell, city_weather) for cell in cells}
+    weather = utils.weather_by_key(cells, inverse, cell_weather)
+
+    prediction = utils.predict_locations(
+        lat, lon, flags, weather, model.classifier, threshold=THRESHOLD
+    )
+    prediction["distance"] = distance
+    prediction["cell"] = inverse
+    metrics.record_rows(len(lat))
+    cell_records = [
+        {"lat": cell[0], "lon": cell[1], **dict(zip(wt.COLUMNS, cell_weather[cell]))}
+        for cell in cells
+    ]
+    return _versioned(responses.render(fmt, prediction, cell_records), model)
+
+
+@app.get("/predict/forecast")
+async def predict_forecast(
+    zip_code: str = None,
+    lat: float = None,
+    lon: float = None,
+    steps: int = Query(8, ge=1, le=40),
+):
+    """
+    Predictions for the next `steps` 3-hour forecast steps (up to 5 days), either
+    for every data point in `zip_code` or for the location at `lat` and `lon`.
+    Each prediction has one label and probability per step, in `times` order.
+    """
+    model = models.active
+    data = store.data
+    if zip_code is not None:
+        rows = data.by_zip(zip_code)
+        if rows is None:
+            raise HTTPException(status_code=404, detail=f"Nothing found for {zip_code}")
+        lats, lons, flags = data.columns(rows)
+        times, weather = await wt.async_client.get_forecast(zip_code=zip_code, steps=steps)
+    elif lat is not None and lon is not None:
+        _, rows = data.nearest((lat, lon))
+        _, _, flags = data.columns(rows)
+        lats, lons = [lat], [lon]
+        times, weather = await wt.async_client.get_forecast(lat=lat, lon=lon, steps=steps)
+    else:
+        raise HTTPException(status_code=400, detail="either zip_code or lat and lon is required")
+
+    prediction = utils.predict_forecast(
+        lats, lons, flags, times, weather, model.classifier, threshold=THRESHOLD
+    )
+    if zip_code is not None:
+        prediction["zip_code"] = zip_code
+    metrics.record_rows(len(lats) * len(times))
+    content = responses.dumps(
+        {
+            "times": np.datetime_as_string(times).tolist(),
+            "weather": [dict(zip(wt.COLUMNS, step)) for step in weather.tolist()],
+            "predictions": utils.to_records(prediction),
+        }
+    )
+    return _versioned(Response(content=content, media_type="application/json"), model)
+
+
+@app.get("/ready")
+async def get_readiness():
+    """
+    200 once the model and the model data are loaded, 503 until then (or if
+    they failed to load). Either way with the time each part of starting up took
+    """
+    status_code = 200 if startup["status"] == "ready" else 503
+    return JSONResponse(status_code=status_code, content=startup)
 
 
 @app.get("/zip_codes")
 async def get_all_zip_codes():
-    return utils.get_all_zip_codes(conn)
+    return store.zip_codes
+
+
+@app.get("/weather/cache")
+async def get_weather_cache_stats():
+    return wt.weather_cache.stats()
+
+
+@app.get("/predict/cache")
+async def get_prediction_cache_stats():
+    return prediction_cache.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request and stage timings, row counts and cache hit rates for Prometheus"""
+    for name, cache in [("weather", wt.weather_cache), ("prediction", prediction_cache)]:
+        metrics.cache_hit_rate.set(cache.stats()["hit_rate"], cache=name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/model")
+async def get_model():
+    """The active model version and every version in MODEL_DIR"""
+    return {
+        "active": models.active.info(),
+        "versions": [
+            {"version": version, "path": path}
+            for version, path, _ in models.versions()
+        ],
+    }
+
+
+@app.post("/reload")
+async def reload_model_data():
+    """
+    Reloads the model data if locations.db changed since it was last loaded, and
+    the model if there is a new version
+    """
+    reloaded = await asyncio.to_thread(store.refresh)
+    if reloaded:
+        prediction_cache.clear()
+    try:
+        model_reloaded = await asyncio.to_thread(models.refresh)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"new model failed to load, still serving {models.active.version}: "
+            + str(e).splitlines()[0],
+        )
+    return {
+        "reloaded": reloaded,
+        "rows": len(store.data),
+        "model_reloaded": model_reloaded,
+        "model_version": models.active.version,
+    }
 
 
 @app.get("/predict/all")
-async def get_all_predictions():
-    model_data = utils.get_all_model_data(conn)
-    md = pd.DataFrame(model_data)
-    zip_codes = tuple(md["Zip_Code"])
-    weather = wt.get_la_weather()
-    w_tuple = tuple(weather.values[0])
-    prediction = utils.make_prediction(md, w_tuple, classifier)
-    [p.update({"zip_code": zc}) for zc, p in zip(zip_codes, prediction)]
-    return {"predictions": prediction, "weather": weather.to_dict("index")[0]}
+async def get_all_predictions(
+    request: Request,
+    format: str = None,
+    live: bool = False,
+    weather_by: str = Query("city", alias="weather"),
+    sample: str = sampling.SAMPLE_MODE,
+):
+    """
+    Predictions for the model data, in the format given by `format` or the Accept
+    header (see responses.py). `ndjson` is streamed, a chunk at a time. Served
+    from the latest background snapshot if there is one, unless `live` is true.
+
+    `weather` picks the weather the predictions use: `city` (the Los Angeles
+    weather for every point), `zip` (each point's zip code weather) or `grid` (the
+    weather of each point's 0.1 degree grid cell). The `weather` key of the
+    response is always the Los Angeles weather.
+
+    `sample` picks which data points are predicted: `full` (all of them),
+    `stratified` (a fixed sample of about `SAMPLE_SIZE` points, spread over the
+    zip codes like the data) or `thinned` (a few points per small grid cell), see
+    sampling.py. The same points are returned on every request.
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    _check_choice("weather", weather_by, WEATHER_MODES)
+    _check_choice("sample", sample, sampling.MODES)
+    data = store.data
+    return await _predict_rows(
+        fmt, data, models.active, data.sample(sample), weather_by, live
+    )
+
+
+@app.get("/predict/bbox")
+async def get_bbox_predictions(
+    request: Request,
+    min_lat: float,
+    max_lat: float,
+    min_lon: float,
+    max_lon: float,
+    format: str = None,
+    live: bool = False,
+    weather_by: str = Query("city", alias="weather"),
+):
+    """
+    Predictions for every data point inside the bounding box (e.g. a map
+    viewport). Takes the same `format`, `weather` and `live` parameters as
+    /predict/all.
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    _check_choice("weather", weather_by, WEATHER_MODES)
+    data = store.data
+    rows = data.within_bbox(min_lat, max_lat, min_lon, max_lon)
+    return await _predict_rows(fmt, data, models.active, rows, weather_by, live)
+
+
+@app.get("/predict/radius")
+async def get_radius_predictions(
+    request: Request,
+    lat: float,
+    lon: float,
+    radius: float = Query(..., gt=0),
+    units: str = "imperial",
+    format: str = None,
+    live: bool = False,
+    weather_by: str = Query("city", alias="weather"),
+):
+    """
+    Predictions for every data point within `radius` miles (or kilometers with
+    `units=metric`) of the latitude-longitude pair, closest first. Takes the same
+    `format`, `weather` and `live` parameters as /predict/all.
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    _check_choice("weather", weather_by, WEATHER_MODES)
+    _check_choice("units", units, list(utils.EARTH_RADIUS))
+    data = store.data
+    _, rows = data.within_radius((lat, lon), radius, units=units)
+    return await _predict_rows(fmt, data, models.active, rows, weather_by, live)
+
+
+@app.get("/predict/tiles")
+async def get_tile_predictions(
+    request: Request,
+    format: str = None,
+    grid: str = "square",
+    zoom: int = Query(12, ge=0, le=24),
+    min_lat: float = -90,
+    max_lat: float = 90,
+    min_lon: float = -180,
+    max_lon: float = 180,
+    live: bool = False,
+    weather_by: str = Query("city", alias="weather"),
+    sample: str = "full",
+):
+    """
+    Predictions for the model data inside the bounding box, summarised per map
+    cell: `grid=square` bins them into the web map tiles of `zoom`, `grid=geohash`
+    into geohash cells of about the same size (see tiles.py). Each cell has the
+    number of data points, their mean probability and the fraction labelled
+    high-risk. `weather`, `sample` and `live` are the same as for /predict/all.
+    """
+    fmt = responses.negotiate(format, request.headers.get("accept"))
+    _check_choice("grid", grid, tiles.GRIDS)
+    _check_choice("weather", weather_by, WEATHER_MODES)
+    _check_choice("sample", sample, sampling.MODES)
+    model = models.active
+    data = store.data
+    rows = data.within_bbox(min_lat, max_lat, min_lon, max_lon)
+    if sample != "full":
+        rows = np.intersect1d(rows, data.sample(sample), assume_unique=True)
+
+    snapshot = None if live or weather_by == "grid" else scheduler.current(data, model)
+    if snapshot is not None:
+        city_weather = snapshot.city_weather
+        prediction = snapshot.predictions(rows, by_zip=weather_by == "zip")
+    else:
+        city_weather, weather = await _row_weather(data, rows, weather_by)
+        prediction = utils.predict_locations(
+            *data.columns(rows), weather, model.classifier, threshold=THRESHOLD
+        )
+    metrics.record_rows(len(rows))
+    cells = tiles.aggregate(
+        prediction["lat"],
+        prediction["lon"],
+        prediction["label"],
+        prediction["probability"],
+        grid=grid,
+        zoom=zoom,
+    )
+    response = responses.render(fmt, cells, dict(zip(wt.COLUMNS, city_weather)))
+    if snapshot is not None:
+        response.headers["X-Generated-At"] = snapshot.generated_at.isoformat()
+    return _versioned(response, model)
+
+
+async def _predict_rows(
+    fmt: str, data, model: ModelVersion, rows: np.ndarray, weather_by: str, live: bool
+):
+    """
+    Renders the predictions for the given rows in `fmt`, from the latest snapshot
+    unless `live` is true or the weather is by grid cell (see /predict/all)
+    """
+    metrics.record_rows(len(rows))
+    snapshot = None if live or weather_by == "grid" else scheduler.current(data, model)
+    if snapshot is not None:
+        weather = dict(zip(wt.COLUMNS, snapshot.city_weather))
+        by_zip = weather_by == "zip"
+        if fmt == "ndjson":
+            response = responses.stream(snapshot.iter_predictions(rows, by_zip), weather)
+        else:
+            response = responses.render(fmt, snapshot.predictions(rows, by_zip), weather)
+        response.headers["X-Generated-At"] = snapshot.generated_at.isoformat()
+        return _versioned(response, model)
+
+    city_weather, weather = await _row_weather(data, rows, weather_by)
+    if fmt == "ndjson":
+        chunks = utils.iter_predictions(
+            data, rows, weather, model.classifier, threshold=THRESHOLD
+        )
+        response = responses.stream(chunks, dict(zip(wt.COLUMNS, city_weather)))
+        return _versioned(response, model)
+
+    prediction = utils.predict_locations(
+        *data.columns(rows), weather, model.classifier, threshold=THRESHOLD
+    )
+    prediction["zip_code"] = data.zip_codes[data.zip_index[rows]]
+    response = responses.render(fmt, prediction, dict(zip(wt.COLUMNS, city_weather)))
+    return _versioned(response, model)
+
+
+async def _row_weather(data, rows, weather_by: str) -> tuple:
+    """
+    Returns the Los Angeles weather and the weather to predict the given rows
+    with: the Los Angeles weather (`city`), one row of weather values per data
+    point from its zip code (`zip`) or its 0.1 degree grid cell (`grid`)
+    """
+    city_weather = await wt.async_client.get_la_weather(type_="tuple")
+    weather = city_weather
+    if weather_by == "zip":
+        zip_codes = data.zip_codes[np.unique(data.zip_index[rows])].tolist()
+        zip_weather = await wt.async_client.get_weather_by_zips(zip_codes)
+        weather = utils.weather_by_row(data, rows, zip_weather, default=city_weather)
+    elif weather_by == "grid":
+        cells, inverse = wt.grid_cells(data.lat[rows], data.lon[rows], precision=1)
+        cell_weather = await wt.async_client.get_weather_by_cells(cells)
+        weather = utils.weather_by_key(cells, inverse, cell_weather, default=city_weather)
+    return city_weather, weather
+
+
+def _versioned(response: Response, model: ModelVersion) -> Response:
+    """Adds the version of the model that made the predictions to the response"""
+    response.headers["X-Model-Version"] = model.version
+    return response
+
+
+def _route_path(request: Request) -> str:
+    """Returns the path template of the route the request matches"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+def _check_choice(name: str, value: str, allowed: list) -> None:
+    if value not in allowed:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{name} must be one of {', '.join(allowed)}, not '{value}'",
+        )
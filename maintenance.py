@@ -0,0 +1,160 @@
+"""
+Schema maintenance for locations.db.
+
+    python maintenance.py migrate [locations.db]
+    python maintenance.py check [locations.db]
+
+    python maintenance.py migrate --no-wal [locations.db]
+
+`migrate` adds the indexes the lookups by zip code need (see `HOT_QUERIES`),
+gives `zip_codes` a primary key, stores the stratified sample of the model data
+(see sampling.py), switches the database to WAL and refreshes the query planner
+statistics. It is safe to run more than once. `check` fails (exit code
+1) if SQLite would answer any of those queries with a full table scan.
+
+A WAL database can't be opened read-only (as db.connect does) unless its
+directory is writable or the -wal and -shm files already exist, so use
+`--no-wal` for a database that is served from a read-only filesystem.
+"""
+import sqlite3
+import sys
+
+import db
+import utils
+
+
+MODEL_DATA_ZIP_INDEX = "idx_model_data_zip_code"
+
+# query, example parameters
+HOT_QUERIES = [
+    (db.MODEL_DATA_BY_ZIP_QUERY, ["90001"]),
+    (db.ZIP_CODE_EXISTS_QUERY, ["90001"]),
+]
+
+
+def migrate(path: str = "locations.db", wal: bool = True) -> None:
+    """
+    Creates a covering index on `model_data(Zip_Code, ...)`, rebuilds `zip_codes`
+    with `zip_code` as its primary key, writes `model_data_sample`, enables WAL
+    (unless `wal` is False) and runs ANALYZE
+    """
+    conn = sqlite3.connect(path)
+    try:
+        # Zip_Code first so lookups by zip code are a range of the index, the
+        # remaining columns so the rows never have to be read from the table
+        columns = ["Zip_Code", *(c for c in db.MODEL_DATA_COLUMNS if c != "Zip_Code")]
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {MODEL_DATA_ZIP_INDEX} "
+            f"ON model_data({', '.join(columns)});"
+        )
+        if not _has_primary_key(conn, "zip_codes", "zip_code"):
+            _rebuild_zip_codes(conn)
+        write_sample(conn)
+        conn.execute("ANALYZE;")
+        conn.commit()
+    finally:
+        conn.close()
+    if wal:
+        enable_wal(path)
+
+
+def enable_wal(path: str = "locations.db") -> bool:
+    """
+    Switches the database to write-ahead logging, so that readers don't block
+    (and aren't blocked by) a process rewriting the data. The journal mode is
+    stored in the file, so this only needs to happen once. Returns False if the
+    database couldn't be switched (e.g. the file is read-only).
+    """
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            mode = conn.execute("PRAGMA journal_mode = WAL;").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return False
+    return mode.lower() == "wal"
+
+
+def write_sample(conn: sqlite3.Connection, size: int = None) -> int:
+    """
+    (Re)creates the `model_data_sample` table holding the rowids of the
+    stratified sample of `model_data` (of about `size` rows, defaults to
+    `sampling.SAMPLE_SIZE`). Returns the number of rows sampled.
+    """
+    sample = utils.get_sample_rowids(conn, size)
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS model_data_sample;")
+        conn.execute("CREATE TABLE model_data_sample (row_id INTEGER PRIMARY KEY);")
+        conn.executemany(
+            "INSERT INTO model_data_sample VALUES (?);", ((int(r),) for r in sample)
+        )
+    return len(sample)
+
+
+def check(path: str = "locations.db") -> list:
+    """
+    Runs EXPLAIN QUERY PLAN on every query in `HOT_QUERIES`. Returns a list of
+    (query, plan step) pairs for the steps that scan a whole table or index;
+    empty if there are none.
+    """
+    problems = []
+    with db.ConnectionPool(path) as pool:
+        for query, params in HOT_QUERIES:
+            for *_, detail in pool.execute(f"EXPLAIN QUERY PLAN {query}", params):
+                if detail.startswith("SCAN"):
+                    problems.append((query, detail))
+    return problems
+
+
+def _rebuild_zip_codes(conn: sqlite3.Connection) -> None:
+    # SQLite can't add a primary key to a table, so copy every column into a new
+    # one (keeping the first row of each zip code) and recreate the other indexes
+    columns = [
+        (name, type_)
+        for _, name, type_, _, _, _ in conn.execute("PRAGMA table_info(zip_codes);")
+    ]
+    definitions = ", ".join(
+        "zip_code TEXT PRIMARY KEY" if name == "zip_code" else f'"{name}" {type_}'
+        for name, type_ in columns
+    )
+    names = ", ".join(f'"{name}"' for name, _ in columns)
+    indexes = [
+        sql
+        for sql, in conn.execute(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = 'zip_codes' AND sql IS NOT NULL;"
+        )
+    ]
+    with conn:
+        conn.execute(f"CREATE TABLE zip_codes_new ({definitions}) WITHOUT ROWID;")
+        conn.execute(
+            f"INSERT OR IGNORE INTO zip_codes_new ({names}) "
+            f"SELECT {names} FROM zip_codes WHERE zip_code IS NOT NULL ORDER BY rowid;"
+        )
+        conn.execute("DROP TABLE zip_codes;")
+        conn.execute("ALTER TABLE zip_codes_new RENAME TO zip_codes;")
+        for sql in indexes:
+            conn.execute(sql)
+
+
+def _has_primary_key(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    # rows of table_info are (cid, name, type, notnull, default, pk)
+    return any(
+        name == column and pk
+        for _, name, _, _, _, pk in conn.execute(f"PRAGMA table_info({table});")
+    )
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--no-wal"]
+    if not args or args[0] not in ["migrate", "check"]:
+        sys.exit(__doc__)
+    path = args[1] if len(args) > 1 else "locations.db"
+    if args[0] == "migrate":
+        migrate(path, wal="--no-wal" not in sys.argv)
+    problems = check(path)
+    for query, detail in problems:
+        print(f"full scan: {detail}\n    {query}")
+    print(f"{len(HOT_QUERIES)} queries checked, {len(problems)} full scans")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,262 @@
+"""
+Request and stage timings, exposed in the Prometheus text format at /metrics.
+
+Code that does a distinct piece of work for a request wraps it in a span:
+
+    with metrics.span("sql"):
+        rows = conn.execute(query).fetchall()
+
+and its duration is recorded in `stage_seconds`, labelled with the stage and the
+endpoint of the request being served (set by the middleware in main.py, work
+done outside of a request is labelled `background`).
+
+`profile` profiles a single request, with pyinstrument's sampling profiler if it
+is installed, cProfile otherwise. Only one request is profiled at a time.
+"""
+import abc
+import bisect
+from contextlib import contextmanager
+import cProfile
+from contextvars import ContextVar
+import functools
+import inspect
+import io
+import pstats
+import threading
+import time
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+
+# the endpoint (route path) of the request the current task is serving
+current_endpoint = ContextVar("current_endpoint", default="background")
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = tuple(10 ** i for i in range(2, 9))  # 100 bytes to 100MB
+
+
+class Metric(abc.ABC):
+    """
+    Base class of the metric types: a named family of values, one per distinct
+    combination of label values
+
+    Arguments
+    ---------
+    name (str): the metric name
+    help (str): description shown in /metrics
+    labels (tuple): names of the labels
+    """
+
+    type_ = None
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> list:
+        """Returns (suffix, labels, value) for every value of the metric"""
+
+    def render(self) -> str:
+        out = io.StringIO()
+        out.write(f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.type_}\n")
+        for suffix, labels, value in self.samples():
+            out.write(f"{self.name}{suffix}{labels} {value}\n")
+        return out.getvalue()
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self._format_labels(key), value) for key, value in items]
+
+
+class Histogram(Metric):
+    """
+    Counts observations into cumulative buckets
+
+    Arguments
+    ---------
+    buckets (tuple): upper bounds of the buckets, in increasing order
+    """
+
+    type_ = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self) -> list:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                samples.append(("_bucket", self._format_labels(key, {"le": le}), cumulative))
+            samples.append(("_sum", self._format_labels(key), counts[-1]))
+            samples.append(("_count", self._format_labels(key), cumulative))
+        return samples
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised by `profile` when another block is already being profiled"""
+
+
+registry = []
+# held while a block is profiled, a second cProfile profiler can't be enabled
+_profiling = threading.Lock()
+
+request_seconds = Histogram(
+    "request_duration_seconds",
+    "Time to handle a request (until the response starts)",
+    ("endpoint", "method", "status"),
+)
+stage_seconds = Histogram(
+    "stage_duration_seconds",
+    "Time spent in each stage of handling a request",
+    ("endpoint", "stage"),
+)
+response_bytes = Histogram(
+    "response_size_bytes",
+    "Size of the response bodies (when known up front)",
+    ("endpoint",),
+    buckets=SIZE_BUCKETS,
+)
+rows_predicted = Gauge(
+    "predicted_rows",
+    "Number of rows predicted by the latest request",
+    ("endpoint",),
+)
+model_data_rows = Gauge("model_data_rows", "Number of rows of model data loaded")
+cache_hit_rate = Gauge("cache_hit_rate", "Hit rate of each cache", ("cache",))
+startup_seconds = Gauge(
+    "startup_duration_seconds", "Time each part of starting up took", ("stage",)
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Records the time spent in the `with` block as `stage` of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(
+            time.perf_counter() - start, endpoint=current_endpoint.get(), stage=stage
+        )
+
+
+def timed(stage: str):
+    """Decorator version of `span`, for functions and coroutine functions"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_rows(count: int) -> None:
+    """Records how many rows the current request predicted"""
+    rows_predicted.set(count, endpoint=current_endpoint.get())
+
+
+@contextmanager
+def profile():
+    """
+    Profiles the `with` block. Yields a list the text report is appended to when
+    the block exits. Raises `ProfilerBusy` if another block is being profiled.
+    """
+    if not _profiling.acquire(blocking=False):
+        raise ProfilerBusy("another request is being profiled")
+    try:
+        with _profile() as report:
+            yield report
+    finally:
+        _profiling.release()
+
+
+@contextmanager
+def _profile():
+    report = []
+    if SamplingProfiler is not None:
+        profiler = SamplingProfiler(async_mode="enabled")
+        profiler.start()
+        try:
+            yield report
+        finally:
+            profiler.stop()
+            report.append(profiler.output_text())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield report
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(50)
+            report.append(out.getvalue())
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text exposition format"""
+    return "".join(metric.render() for metric in registry)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
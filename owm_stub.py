@@ -0,0 +1,92 @@
+"""
+Local stand-in for the parts of the OpenWeatherMap API the server uses, with
+configurable latency and error rate, for load tests that shouldn't need an API
+key or burn quota. Point the server at it with `OWM_BASE_URL`:
+
+    python owm_stub.py --port 8001 --latency 0.2 --jitter 0.05 --error-rate 0.01
+    OWM_BASE_URL=http://localhost:8001 uvicorn main:app --port 8000
+
+The weather is made up, but stable for a given location.
+"""
+import argparse
+import asyncio
+import random
+import time
+import zlib
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+
+class StubSettings:
+    """
+    Arguments
+    ---------
+    latency (float): mean delay of a response in seconds
+    jitter (float): standard deviation of the delay in seconds
+    error_rate (float): fraction of requests answered with a 500 error
+    """
+
+    def __init__(self, latency: float = 0.1, jitter: float = 0.02, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+settings = StubSettings()
+app = FastAPI()
+
+
+@app.middleware("http")
+async def simulate_upstream(request: Request, call_next):
+    await asyncio.sleep(max(0.0, random.gauss(settings.latency, settings.jitter)))
+    if random.random() < settings.error_rate:
+        return JSONResponse(status_code=500, content={"cod": 500, "message": "stub error"})
+    return await call_next(request)
+
+
+@app.get("/data/2.5/weather")
+async def current_weather(zip: str = None, lat: float = None, lon: float = None):
+    return _weather(zip or f"{lat},{lon}")
+
+
+@app.get("/data/2.5/forecast")
+async def forecast(
+    zip: str = None, id: int = None, lat: float = None, lon: float = None, cnt: int = 40
+):
+    key = zip or (str(id) if id is not None else f"{lat},{lon}")
+    now = int(time.time()) // 10800 * 10800
+    steps = [
+        {**_weather(f"{key}/{i}"), "dt": now + 10800 * (i + 1)} for i in range(min(cnt, 40))
+    ]
+    return {"cnt": len(steps), "list": steps, "city": {"timezone": -28800}}
+
+
+def _weather(key: str) -> dict:
+    """Made-up current weather JSON, the same for the same key"""
+    rng = random.Random(zlib.crc32(key.encode()))
+    weather = {
+        "main": {
+            "temp": round(rng.uniform(283, 303), 2),  # kelvin
+            "humidity": rng.randint(20, 90),
+            "pressure": rng.randint(1000, 1025),
+        },
+        "wind": {"speed": round(rng.uniform(0, 10), 2)},
+    }
+    if rng.random() < 0.2:
+        weather["rain"] = {"1h": round(rng.uniform(0, 0.5), 2)}
+    return weather
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenWeatherMap stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=settings.latency)
+    parser.add_argument("--jitter", type=float, default=settings.jitter)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate)
+    args = parser.parse_args()
+    settings.latency, settings.jitter = args.latency, args.jitter
+    settings.error_rate = args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
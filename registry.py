@@ -0,0 +1,273 @@
+"""
+Versioned models, loaded from a directory and swapped without restarting the
+server. Each model file in `MODEL_DIR` is a version, named after the file:
+
+    models/
+        2024-05-01.ubj
+        2024-06-01.ubj   <- the most recently modified file is served
+
+Publish a new version with
+
+    python registry.py publish model.json [version] [--dir models]
+
+which writes it in XGBoost's binary UBJSON format (faster to load than JSON) and
+a JSON copy for the numpy engine, each under a hidden name first so the watcher
+never sees half a file. Touching an older file rolls back to it.
+
+Models are loaded from a preprocessed copy kept in a cache directory when there
+is one: UBJSON for the xgboost engine, an .npz of the tree arrays for the numpy
+engine (see `ModelRegistry.artifact`).
+"""
+import argparse
+import asyncio
+from collections import namedtuple
+from datetime import datetime
+import hashlib
+import os
+import traceback
+
+import numpy as np
+
+from classifier import Classifier, build_features
+from store import FLAG_COLUMNS
+from synthetic import LAT_RANGE, LON_RANGE
+from trees import TreeEnsemble
+
+
+# model file extensions each engine can load, preferred first
+FORMATS = {"xgboost": [".ubj", ".json"], "numpy": [".json"]}
+# format of the preprocessed copies each engine loads fastest
+ARTIFACT_FORMATS = {"xgboost": ".ubj", "numpy": ".npz"}
+WARMUP_WEATHER = (68.0, 60.0, 29.9, 5.0, 0.0)
+
+
+class ModelVersion(
+    namedtuple("ModelVersion", ["version", "path", "mtime", "classifier", "loaded_at"])
+):
+    """A loaded, warmed-up model and where it came from"""
+
+    __slots__ = ()
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "modified_at": datetime.fromtimestamp(self.mtime).isoformat(),
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+class ModelRegistry:
+    """
+    Serves the most recently modified model in `directory` (or `fallback` when
+    the directory has none) as `active`. New versions are loaded and warmed up in
+    the background and replace the active one in a single assignment: handlers
+    that read `active` once per request finish on the version they started with.
+    A version that fails to load or warm up is skipped and the active one kept.
+
+    Arguments
+    ---------
+    directory (str): where the model versions are
+    fallback (str): model to serve when `directory` has no models
+    engine (str): `xgboost` or `numpy`, see `Classifier.load_model`
+    poll (float): how often (in seconds) to check for new versions, 0 to only
+    load them on `refresh`
+    warmup_rows (int): size of the batch a new version scores before serving
+    on_swap (callable): called with the new `ModelVersion` after every swap
+    cache_dir (str): where to keep the preprocessed copies of the models, None
+    to always load the model files themselves
+    """
+
+    def __init__(
+        self,
+        directory: str = "models",
+        fallback: str = "model.json",
+        engine: str = "xgboost",
+        poll: float = 30,
+        warmup_rows: int = 1024,
+        on_swap=None,
+        cache_dir: str = None,
+    ) -> None:
+        if engine not in FORMATS:
+            raise ValueError(f"'engine' must be one of {', '.join(FORMATS)} not {engine}")
+        self.directory = directory
+        self.fallback = fallback
+        self.engine = engine
+        self.poll = poll
+        self.warmup_rows = warmup_rows
+        self.on_swap = on_swap
+        self.cache_dir = cache_dir
+        self.active = None
+        self._failed = None
+        self._task = None
+
+    def versions(self) -> list:
+        """
+        Returns (version, path, mtime) of every model in the directory the engine
+        can load, oldest first. When a version has several formats the preferred
+        one is used.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = {}
+        for entry in os.scandir(self.directory):
+            version, ext = os.path.splitext(entry.name)
+            hidden = entry.name.startswith(".")
+            if hidden or not entry.is_file() or ext not in FORMATS[self.engine]:
+                continue
+            rank = FORMATS[self.engine].index(ext)
+            if version not in found or rank < found[version][0]:
+                found[version] = (rank, entry.path, entry.stat().st_mtime)
+        return sorted(
+            ((version, path, mtime) for version, (_, path, mtime) in found.items()),
+            key=lambda v: (v[2], v[0]),
+        )
+
+    def latest(self) -> tuple:
+        """Returns (version, path, mtime) of the model that should be served"""
+        versions = self.versions()
+        if versions:
+            return versions[-1]
+        if os.path.exists(self.fallback):
+            version = os.path.splitext(os.path.basename(self.fallback))[0]
+            return version, self.fallback, os.path.getmtime(self.fallback)
+        raise FileNotFoundError(f"no models in {self.directory} and no {self.fallback}")
+
+    def load(self, version: str, path: str, mtime: float) -> ModelVersion:
+        """Loads and warms up a model, raises ValueError if it scores nonsense"""
+        classifier = Classifier.load_model(self.artifact(path, mtime), engine=self.engine)
+        warm_up(classifier, self.warmup_rows)
+        return ModelVersion(version, path, mtime, classifier, datetime.now())
+
+    def artifact(self, path: str, mtime: float) -> str:
+        """
+        Returns the path of the fastest loading copy of the model at `path`,
+        which is made on first use and kept in `cache_dir` (keyed by the path and
+        modification time of the model). Falls back to `path` itself when there's
+        no cache directory or it can't be written to.
+        """
+        ext = ARTIFACT_FORMATS[self.engine]
+        if self.cache_dir is None or path.endswith(ext):
+            return path
+        key = hashlib.sha1(f"{os.path.abspath(path)}:{mtime}".encode()).hexdigest()[:16]
+        artifact = os.path.join(self.cache_dir, key + ext)
+        if os.path.exists(artifact):
+            return artifact
+        # other workers may be writing the same copy, so each writes its own
+        tmp = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.tmp{ext}")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if self.engine == "numpy":
+                TreeEnsemble.from_json(path).save(tmp)
+            else:
+                from xgboost import Booster
+
+                Booster(model_file=path).save_model(tmp)
+            os.replace(tmp, artifact)
+        except OSError:
+            traceback.print_exc()
+            return path
+        return artifact
+
+    def refresh(self) -> bool:
+        """
+        Loads the latest version if it isn't the active one, returns whether the
+        active model changed. Blocks while the model loads, see `start` to do it
+        in the background.
+        """
+        latest = self.latest()
+        active = self.active
+        if active is not None and (active.version, active.path, active.mtime) == latest:
+            return False
+        if active is not None and latest == self._failed:
+            return False  # don't retry a broken file until it changes
+        try:
+            model = self.load(*latest)
+        except Exception:
+            self._failed = latest
+            raise
+        self.active = model
+        if self.on_swap is not None:
+            self.on_swap(model)
+        return True
+
+    def start(self) -> None:
+        if self._task is None and self.poll > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # keep serving the active version and try again at the next poll
+                traceback.print_exc()
+
+
+def warm_up(classifier: Classifier, rows: int = 1024, seed: int = 0) -> np.ndarray:
+    """
+    Scores a batch of made-up locations with the classifier, so the first
+    requests don't pay for lazy initialisation, and checks the probabilities
+    are valid. Returns the probabilities.
+    """
+    rng = np.random.default_rng(seed)
+    # placed where the synthetic data is, roughly the Los Angeles area
+    lat = rng.uniform(*LAT_RANGE, rows)
+    lon = rng.uniform(*LON_RANGE, rows)
+    flags = {name: rng.random(rows) < 0.1 for name in FLAG_COLUMNS}
+    features = build_features(lat, lon, flags, WARMUP_WEATHER, datetime.now())
+    _, probabilities = classifier.score(features)
+    if not np.all((probabilities >= 0) & (probabilities <= 1)):
+        raise ValueError("model returned probabilities outside [0, 1] on the warm-up batch")
+    return probabilities
+
+
+def publish(path: str, directory: str = "models", version: str = None) -> str:
+    """
+    Copies a saved XGBoost model into `directory` as `version` (defaults to the
+    current time), in UBJSON and JSON. Returns the version.
+    """
+    from xgboost import Booster
+
+    version = version or datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs(directory, exist_ok=True)
+    booster = Booster(model_file=path)
+    # UBJSON first: a server preferring it never loads the JSON copy in between
+    for ext in [".ubj", ".json"]:
+        target = os.path.join(directory, version + ext)
+        # the extension decides the format, the leading dot hides it from versions()
+        tmp = os.path.join(directory, f".{version}.tmp{ext}")
+        booster.save_model(tmp)
+        os.replace(tmp, target)
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the served model versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_parser = commands.add_parser("publish", help="add a model version")
+    publish_parser.add_argument("model")
+    publish_parser.add_argument("version", nargs="?", default=None)
+    publish_parser.add_argument("--dir", default="models")
+    list_parser = commands.add_parser("list", help="list the model versions")
+    list_parser.add_argument("--dir", default="models")
+    list_parser.add_argument("--engine", default="xgboost", choices=list(FORMATS))
+    args = parser.parse_args()
+    if args.command == "publish":
+        print(f"published {publish(args.model, args.dir, args.version)}")
+    else:
+        registry = ModelRegistry(args.dir, engine=args.engine)
+        for version, path, mtime in registry.versions():
+            print(f"{version:<24} {datetime.fromtimestamp(mtime).isoformat()} {path}")
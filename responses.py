@@ -0,0 +1,149 @@
+"""
+Encodes prediction columns (see `utils.predict_locations`) in the response
+formats the prediction endpoints support:
+
+- `json`: `{"predictions": [{...}, ...], "weather": {...}}`, one object per row
+- `columns`: `{"predictions": {"lat": [...], ...}, "weather": {...}}`, one array
+  per column (values shared by every row, like `time`, are not repeated)
+- `ndjson`: newline-delimited JSON, the weather first then one row per line
+- `arrow`: an Apache Arrow IPC stream, the weather is in the schema metadata
+
+JSON is encoded with orjson when it is installed, Arrow needs pyarrow.
+"""
+from datetime import datetime
+import json
+from typing import Iterable
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+import numpy as np
+
+import metrics
+import utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+FORMATS = {
+    "json": "application/json",
+    "columns": "application/json",
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "arrow": ARROW_MEDIA_TYPE,
+}
+
+
+def negotiate(format: str = None, accept: str = None) -> str:
+    """
+    Picks the response format from the `format` query parameter or, if that isn't
+    given, from the Accept header. Defaults to `json`.
+    """
+    if format is not None:
+        if format not in FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"format must be one of {', '.join(FORMATS)}, not '{format}'",
+            )
+        return format
+    accept = accept or ""
+    if ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    if NDJSON_MEDIA_TYPE in accept:
+        return "ndjson"
+    return "json"
+
+
+def render(format: str, columns: dict, weather: dict) -> Response:
+    """Encodes the prediction columns and the weather in the given format"""
+    if format not in FORMATS:
+        raise ValueError(f"unknown format '{format}'")
+    with metrics.span("encode"):
+        if format == "json":
+            content = dumps({"predictions": utils.to_records(columns), "weather": weather})
+        elif format == "columns":
+            content = dumps({"predictions": _json_columns(columns), "weather": weather})
+        elif format == "ndjson":
+            content = dumps({"weather": weather}) + b"\n" + to_ndjson(columns)
+        else:
+            content = to_arrow(columns, weather)
+    return Response(content=content, media_type=FORMATS[format])
+
+
+def stream(chunks: Iterable[dict], weather: dict) -> StreamingResponse:
+    """
+    Streams chunks of prediction columns (e.g. from `utils.iter_predictions`) as
+    newline-delimited JSON, encoding each chunk once it is ready
+    """
+
+    def lines():
+        yield dumps({"weather": weather}) + b"\n"
+        for chunk in chunks:
+            with metrics.span("encode"):
+                encoded = to_ndjson(chunk)
+            yield encoded
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_json_default).encode()
+
+
+def to_ndjson(columns: dict) -> bytes:
+    """Encodes a dict of columns as newline-delimited JSON, one object per row"""
+    return b"".join(dumps(record) + b"\n" for record in utils.to_records(columns))
+
+
+def to_arrow(columns: dict, weather: dict) -> bytes:
+    """Encodes a dict of columns as an Arrow IPC stream"""
+    if pa is None:
+        raise HTTPException(status_code=406, detail="pyarrow is needed for format=arrow")
+    n = max((len(value) for value in columns.values() if np.ndim(value)), default=0)
+    arrays = {}
+    for name, value in columns.items():
+        if isinstance(value, datetime):
+            value = np.full(n, np.datetime64(value, "us"))
+        elif np.ndim(value) == 0:
+            value = np.full(n, value)
+        value = np.asarray(value)
+        if value.dtype.kind in "OUS":
+            arrays[name] = pa.array(value.tolist()).dictionary_encode()
+        else:
+            arrays[name] = pa.array(value)
+    table = pa.table(arrays).replace_schema_metadata({"weather": json.dumps(weather)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _json_columns(columns: dict) -> dict:
+    out = {}
+    for name, value in columns.items():
+        if np.ndim(value) == 0:
+            out[name] = value
+        elif orjson is not None and np.asarray(value).dtype.kind in "biuf":
+            # orjson already writes float32 in its shortest representation
+            out[name] = np.ascontiguousarray(value)
+        elif name in utils.COORDINATE_COLUMNS:
+            out[name] = utils.widen_coordinates(value).tolist()
+        else:
+            out[name] = np.asarray(value).tolist()
+    return out
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,80 @@
+"""
+Deterministic subsets of the model data, so /predict/all can return fewer points
+without `ORDER BY RANDOM()` and gives the same points on every request:
+
+- `full`: every data point
+- `stratified`: about `SAMPLE_SIZE` points, the same fraction of every zip code
+- `thinned`: at most `THIN_PER_CELL` points per grid cell of `THIN_PRECISION`
+  decimal places, which evens out the density of the points on a map
+
+Which points are picked only depends on their rowids, so a sample is stable
+across restarts and reloads. `python maintenance.py migrate` stores the
+stratified sample in the `model_data_sample` table.
+"""
+import os
+
+import numpy as np
+
+
+MODES = ["full", "stratified", "thinned"]
+SAMPLE_MODE = os.environ.get("SAMPLE_MODE", "stratified")
+SAMPLE_SIZE = int(os.environ.get("SAMPLE_SIZE", 100000))
+THIN_PRECISION = int(os.environ.get("THIN_PRECISION", 3))  # 3 -> cells of ~100m
+THIN_PER_CELL = int(os.environ.get("THIN_PER_CELL", 1))
+
+
+def stratified(zip_index: np.ndarray, rowid: np.ndarray, size: int = SAMPLE_SIZE) -> np.ndarray:
+    """
+    Picks about `size` rows, the same fraction of every zip code (and at least
+    one row of each).
+
+    Arguments
+    ---------
+    zip_index (np.ndarray): the zip code (or any other stratum) of each row
+    rowid (np.ndarray): the rowid of each row
+    size (int): number of rows to pick
+
+    Returns
+    -------
+    (np.ndarray) sorted positions of the picked rows
+    """
+    if size >= len(rowid):
+        return np.arange(len(rowid))
+    _, group, counts = np.unique(zip_index, return_inverse=True, return_counts=True)
+    quota = np.maximum(1, np.round(counts * (size / len(rowid)))).astype(np.int64)
+    return _lowest_priority(group.ravel(), rowid, quota)
+
+
+def thinned(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    rowid: np.ndarray,
+    precision: int = THIN_PRECISION,
+    per_cell: int = THIN_PER_CELL,
+) -> np.ndarray:
+    """
+    Picks at most `per_cell` rows from every grid cell (latitude and longitude
+    rounded to `precision` decimal places)
+
+    Returns
+    -------
+    (np.ndarray) sorted positions of the picked rows
+    """
+    keys = np.column_stack([np.round(lat, precision), np.round(lon, precision)])
+    _, cell = np.unique(keys.astype(np.float64), axis=0, return_inverse=True)
+    cell = cell.ravel()
+    quota = np.full(cell.max() + 1 if len(cell) else 0, per_cell, dtype=np.int64)
+    return _lowest_priority(cell, rowid, quota)
+
+
+def _priority(rowid: np.ndarray) -> np.ndarray:
+    # a fixed pseudo-random permutation of the rowids (Knuth's multiplicative hash)
+    return (rowid.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2**32)
+
+
+def _lowest_priority(group: np.ndarray, rowid: np.ndarray, quota: np.ndarray) -> np.ndarray:
+    # rows ordered by group, then by priority; keep the first `quota` of each group
+    order = np.lexsort((_priority(rowid), group))
+    starts = np.searchsorted(group[order], np.arange(len(quota)))
+    rank = np.arange(len(order)) - starts[group[order]]
+    return np.sort(order[rank < quota[group[order]]])
@@ -0,0 +1,190 @@
+"""
+Predictions for every model data point, recomputed in the background so the
+prediction endpoints can serve them without scoring anything per request.
+"""
+import asyncio
+from collections import namedtuple
+from datetime import datetime
+import traceback
+
+from classifier import build_features
+from registry import ModelRegistry, ModelVersion
+from store import ModelData, ModelDataStore
+import utils
+import weather as wt
+
+
+class Snapshot(
+    namedtuple(
+        "Snapshot",
+        [
+            "generated_at",
+            "data",
+            "model",
+            "city_weather",
+            "city_label",
+            "city_probability",
+            "zip_weather",
+            "zip_label",
+            "zip_probability",
+        ],
+    )
+):
+    """
+    An immutable set of predictions for every row of `data`, made at
+    `generated_at` by `model` (a `registry.ModelVersion`):
+
+    - `city_weather`, `city_label` and `city_probability` use the Los Angeles
+      weather for every row (as /predict/all does)
+    - `zip_weather`, `zip_label` and `zip_probability` use the weather of each
+      row's zip code (as /predict/zip does). Zip codes whose weather couldn't be
+      fetched are missing from `zip_weather` and use the Los Angeles weather
+    """
+
+    __slots__ = ()
+
+    def predictions(self, rows, by_zip: bool = False) -> dict:
+        """
+        Returns the predictions for the given rows in the same form as
+        `utils.predict_locations` (plus `zip_code`)
+        """
+        label, probability = (
+            (self.zip_label, self.zip_probability)
+            if by_zip
+            else (self.city_label, self.city_probability)
+        )
+        return {
+            "time": self.generated_at,
+            "lat": self.data.lat[rows],
+            "lon": self.data.lon[rows],
+            "label": label[rows],
+            "probability": probability[rows],
+            "zip_code": self.data.zip_codes[self.data.zip_index[rows]],
+        }
+
+    def iter_predictions(self, rows, by_zip: bool = False, chunk_size: int = 10000):
+        """Same as `predictions`, but yields `chunk_size` rows at a time"""
+        for start in range(0, len(rows), chunk_size):
+            yield self.predictions(rows[start:start + chunk_size], by_zip=by_zip)
+
+
+class SnapshotScheduler:
+    """
+    Keeps `snapshot` up to date: it is recomputed every `interval` seconds, and
+    sooner if the hour, the Los Angeles weather, the model data or the active
+    model version changes. A new snapshot replaces the old one in a single
+    assignment, so readers always see a complete snapshot.
+
+    Arguments
+    ---------
+    store (ModelDataStore): the model data
+    models (ModelRegistry): the model versions, snapshots use the active one
+    interval (float): maximum age of a snapshot in seconds
+    threshold (float): locations whose probability is above this are labelled 1
+    poll (float): how often (in seconds) to check whether the snapshot is stale
+    """
+
+    def __init__(
+        self,
+        store: ModelDataStore,
+        models: ModelRegistry,
+        interval: float = 600,
+        threshold: float = 0.5,
+        poll: float = 60,
+    ) -> None:
+        self.store = store
+        self.models = models
+        self.interval = interval
+        self.threshold = threshold
+        self.poll = min(poll, interval)
+        self.snapshot = None
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def current(self, data: ModelData, model: ModelVersion = None) -> Snapshot:
+        """
+        Returns the latest snapshot if it was made from `data` by `model` (the
+        active model by default), otherwise None
+        """
+        snapshot = self.snapshot
+        model = self.models.active if model is None else model
+        if snapshot is not None and snapshot.data is data and snapshot.model is model:
+            return snapshot
+        return None
+
+    async def refresh(self) -> Snapshot:
+        """Recomputes the snapshot now"""
+        data, model = self.store.data, self.models.active
+        city_weather = await wt.async_client.get_la_weather(type_="tuple")
+        zip_weather = await wt.async_client.get_weather_by_zips(list(data.zip_slices))
+        self.snapshot = await asyncio.to_thread(
+            self._score, data, model, datetime.now(), city_weather, zip_weather
+        )
+        return self.snapshot
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._is_stale():
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # keep serving the last snapshot and try again at the next poll
+                traceback.print_exc()
+            await asyncio.sleep(self.poll)
+
+    async def _is_stale(self) -> bool:
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.data is not self.store.data:
+            return True
+        if snapshot.model is not self.models.active:
+            return True
+        now = datetime.now()
+        if (now - snapshot.generated_at).total_seconds() >= self.interval:
+            return True
+        if now.hour != snapshot.generated_at.hour:
+            return True
+        return await wt.async_client.get_la_weather(type_="tuple") != snapshot.city_weather
+
+    def _score(
+        self,
+        data: ModelData,
+        model: ModelVersion,
+        when: datetime,
+        city_weather: tuple,
+        zip_weather: dict,
+    ) -> Snapshot:
+        lat, lon, flags = data.columns()
+        features = build_features(lat, lon, flags, city_weather, when)
+        city_label, city_probability = model.classifier.score(features, self.threshold)
+        row_weather = utils.weather_by_row(
+            data, slice(None), zip_weather, default=city_weather
+        )
+        build_features(lat, lon, flags, row_weather, when, out=features)
+        zip_label, zip_probability = model.classifier.score(features, self.threshold)
+        for array in [city_label, city_probability, zip_label, zip_probability]:
+            array.setflags(write=False)
+        return Snapshot(
+            generated_at=when,
+            data=data,
+            model=model,
+            city_weather=city_weather,
+            city_label=city_label,
+            city_probability=city_probability,
+            zip_weather=zip_weather,
+            zip_label=zip_label,
+            zip_probability=zip_probability,
+        )
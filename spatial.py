@@ -0,0 +1,101 @@
+"""
+Spatial index over the model data locations. Used to find the model data points
+closest to a latitude-longitude pair without scanning every row in the database.
+"""
+import numpy as np
+
+from utils import EARTH_RADIUS
+
+
+class SpatialIndex:
+    """
+    Ball tree (haversine metric) over latitude-longitude pairs. Built once over
+    the whole `model_data` table, queries return positional indices into the
+    arrays the index was built from.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, leaf_size: int = 40) -> None:
+        # imported here, scikit-learn is slow to import and only needed once the
+        # model data is loaded
+        from sklearn.neighbors import BallTree
+
+        points = np.radians(np.column_stack([lat, lon]).astype(np.float64))
+        self._tree = BallTree(points, leaf_size=leaf_size, metric="haversine")
+        self._size = len(points)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def nearest(
+        self,
+        location: tuple,
+        k: int = 1,
+        radius: float = None,
+        units: str = "imperial",
+    ) -> tuple:
+        """
+        Finds the `k` data points closest to the given location.
+
+        Arguments
+        ---------
+        location (tuple): latitude-longitude pair
+        k (int): number of neighbors to return
+        radius (float): if given, neighbors further away than this are dropped
+        units (str): units of `radius` and of the returned distances, imperial
+        (miles, default) or metric (kilometers)
+
+        Returns
+        -------
+        (tuple): arrays of distances and indices, closest first
+        """
+        k = min(k, self._size)
+        dist, idx = self._tree.query(np.radians([location]), k=k)
+        dist, idx = dist[0] * EARTH_RADIUS[units], idx[0]
+        if radius is not None:
+            mask = dist <= radius
+            dist, idx = dist[mask], idx[mask]
+        return dist, idx
+
+    def nearest_many(
+        self, lat: np.ndarray, lon: np.ndarray, units: str = "imperial"
+    ) -> tuple:
+        """
+        Finds the data point closest to each of many locations in a single query.
+
+        Arguments
+        ---------
+        lat (np.ndarray): latitude of each location
+        lon (np.ndarray): longitude of each location
+        units (str): units of the returned distances, imperial (miles, default) or
+        metric (kilometers)
+
+        Returns
+        -------
+        (tuple): arrays of distances and indices, one per location
+        """
+        points = np.radians(np.column_stack([lat, lon]).astype(np.float64))
+        dist, idx = self._tree.query(points, k=1)
+        return dist[:, 0] * EARTH_RADIUS[units], idx[:, 0]
+
+    def within(self, location: tuple, radius: float, units: str = "imperial") -> tuple:
+        """
+        Finds every data point within `radius` of the given location.
+
+        Arguments
+        ---------
+        location (tuple): latitude-longitude pair
+        radius (float): search radius
+        units (str): units of `radius` and of the returned distances, imperial
+        (miles, default) or metric (kilometers)
+
+        Returns
+        -------
+        (tuple): arrays of distances and indices, closest first
+        """
+        idx, dist = self._tree.query_radius(
+            np.radians([location]),
+            r=radius / EARTH_RADIUS[units],
+            return_distance=True,
+            sort_results=True,
+        )
+        return dist[0] * EARTH_RADIUS[units], idx[0]
@@ -0,0 +1,260 @@
+"""
+In-memory, column-oriented copy of the `model_data` table. Loaded once at startup
+so that requests slice NumPy arrays instead of querying the database and building
+a dict for every row.
+"""
+from collections import namedtuple
+import os
+import sqlite3
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+import db
+import metrics
+import sampling
+from spatial import SpatialIndex
+import utils
+
+
+FLAG_COLUMNS = [
+    "Amenity",
+    "Bump",
+    "Crossing",
+    "Give_Way",
+    "Junction",
+    "No_Exit",
+    "Railway",
+    "Roundabout",
+    "Station",
+    "Stop",
+    "Traffic_Calming",
+    "Traffic_Signal",
+    "Turning_Loop",
+]
+COLUMNS = ["Start_Lat", "Start_Lng", *FLAG_COLUMNS, "Zip_Code"]
+
+
+class ModelData:
+    """
+    Immutable set of model data arrays sorted by zip code, so the rows of each zip
+    code are a contiguous slice.
+
+    Arguments
+    ---------
+    lat (np.ndarray): float32 latitudes
+    lon (np.ndarray): float32 longitudes
+    flags (dict): maps each of FLAG_COLUMNS to a uint8 array
+    zip_codes (np.ndarray): the distinct zip codes, sorted
+    zip_index (np.ndarray): position of each row's zip code in `zip_codes`
+    rowid (np.ndarray): rowid of each row in the `model_data` table
+    sample_rowid (np.ndarray): rowids of the stored stratified sample, if any
+    (see `sampling`)
+    """
+
+    def __init__(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        flags: dict,
+        zip_codes: np.ndarray,
+        zip_index: np.ndarray,
+        rowid: np.ndarray = None,
+        sample_rowid: np.ndarray = None,
+    ) -> None:
+        self.lat = lat
+        self.lon = lon
+        self.flags = flags
+        self.zip_codes = zip_codes
+        self.zip_index = zip_index
+        self.rowid = np.arange(len(lat), dtype=np.int64) if rowid is None else rowid
+        self.sample_rowid = sample_rowid
+        self._samples = {}
+        bounds = np.searchsorted(zip_index, np.arange(len(zip_codes) + 1))
+        self.zip_slices = {
+            zc: slice(start, end)
+            for zc, start, end in zip(zip_codes.tolist(), bounds[:-1], bounds[1:])
+        }
+        self.spatial_index = SpatialIndex(lat, lon)
+        # rows ordered by latitude, so a latitude range is a binary search away
+        self._lat_order = np.argsort(lat, kind="stable")
+        self._sorted_lat = lat[self._lat_order]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "ModelData":
+        """
+        Reads the rows of the `model_data` table into arrays, leaving out rows
+        with missing values (see `db.COMPLETE_ROWS`)
+        """
+        lat, lon, *flags, zip_code, rowid = db.arrays(
+            conn,
+            f"SELECT {', '.join(COLUMNS)}, rowid FROM model_data WHERE {db.COMPLETE_ROWS};",
+            dtypes=[np.float32, np.float32, *[np.uint8] * len(FLAG_COLUMNS), str, np.int64],
+        )
+
+        sample_rowid = None
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+            ["model_data_sample"],
+        ).fetchone():
+            (sample_rowid,) = db.arrays(
+                conn, "SELECT row_id FROM model_data_sample;", dtypes=[np.int64]
+            )
+
+        zip_codes, zip_index = np.unique(zip_code, return_inverse=True)
+        order = np.argsort(zip_index, kind="stable")
+        zip_index = zip_index[order].astype(np.min_scalar_type(max(len(zip_codes) - 1, 0)))
+        return cls(
+            lat=lat[order],
+            lon=lon[order],
+            flags={name: flag[order] for name, flag in zip(FLAG_COLUMNS, flags)},
+            zip_codes=zip_codes,
+            zip_index=zip_index,
+            rowid=rowid[order],
+            sample_rowid=sample_rowid,
+        )
+
+    def sample(self, mode: str = sampling.SAMPLE_MODE) -> np.ndarray:
+        """
+        Returns the (sorted) rows of the given sampling mode, one of
+        `sampling.MODES`. Samples are computed once per `ModelData`; the stratified
+        sample is the stored one if the database has it.
+        """
+        if mode not in sampling.MODES:
+            raise ValueError(f"mode must be one of {', '.join(sampling.MODES)}, not '{mode}'")
+        if mode not in self._samples:
+            if mode == "full":
+                rows = np.arange(len(self))
+            elif mode == "stratified" and self.sample_rowid is not None:
+                rows = np.flatnonzero(np.isin(self.rowid, self.sample_rowid))
+            elif mode == "stratified":
+                rows = sampling.stratified(self.zip_index, self.rowid)
+            else:
+                rows = sampling.thinned(self.lat, self.lon, self.rowid)
+            rows.setflags(write=False)
+            self._samples[mode] = rows
+        return self._samples[mode]
+
+    def by_zip(self, zip_code: str) -> slice:
+        """Returns the rows belonging to the given zip code, None if there are none"""
+        return self.zip_slices.get(zip_code)
+
+    def nearest(self, location: tuple, k: int = 1, radius: float = None) -> tuple:
+        """
+        Returns the distances (in miles) and row indices of the `k` rows closest to
+        the given latitude-longitude pair
+        """
+        return self.spatial_index.nearest(location, k=k, radius=radius)
+
+    def nearest_many(self, lat: np.ndarray, lon: np.ndarray) -> tuple:
+        """
+        Returns the distance (in miles) to and row index of the row closest to each
+        of the given locations
+        """
+        return self.spatial_index.nearest_many(lat, lon)
+
+    def within_bbox(
+        self, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+    ) -> np.ndarray:
+        """Returns the (sorted) rows inside the given bounding box, edges included"""
+        start = np.searchsorted(self._sorted_lat, np.float32(min_lat), side="left")
+        end = np.searchsorted(self._sorted_lat, np.float32(max_lat), side="right")
+        rows = self._lat_order[start:end]
+        lon = self.lon[rows]
+        return np.sort(rows[(lon >= min_lon) & (lon <= max_lon)])
+
+    def within_radius(
+        self, location: tuple, radius: float, units: str = "imperial"
+    ) -> tuple:
+        """
+        Returns the distances (in `units`, miles by default) to and row indices of
+        every row within `radius` of the given latitude-longitude pair, closest first
+        """
+        return self.spatial_index.within(location, radius, units=units)
+
+    def columns(self, rows: Union[slice, np.ndarray] = slice(None)) -> tuple:
+        """
+        Returns the latitudes, longitudes and flags (a dict of arrays) of the given
+        rows, in the form `classifier.build_features` takes them
+        """
+        flags = {name: flag[rows] for name, flag in self.flags.items()}
+        return self.lat[rows], self.lon[rows], flags
+
+    def frame(self, rows: Union[slice, np.ndarray] = slice(None)) -> pd.DataFrame:
+        """
+        Returns the given rows as a DataFrame with the same columns as
+        `utils.get_all_model_data(type_="pd")`
+        """
+        columns = {"Start_Lat": self.lat[rows], "Start_Lng": self.lon[rows]}
+        columns.update({name: flag[rows] for name, flag in self.flags.items()})
+        columns["Zip_Code"] = pd.Categorical.from_codes(
+            self.zip_index[rows], self.zip_codes
+        )
+        return pd.DataFrame(columns)
+
+
+class Loaded(namedtuple("Loaded", ["data", "zip_codes", "zip_code_set", "mtime"])):
+    """
+    What a `ModelDataStore` read from its database: the `ModelData`, the zip
+    codes of the `zip_codes` table (as a list and a set for O(1) membership
+    tests) and the modification time of the file
+    """
+
+    __slots__ = ()
+
+
+class ModelDataStore:
+    """
+    Holds what was last read from a database file as a single `Loaded` tuple,
+    which `reload` replaces in one assignment. Handlers should read `store.loaded`
+    (or `store.data` if that's all they need) once per request, so the model data
+    and zip codes they use always come from the same load.
+
+    Arguments
+    ---------
+    path (str): path to the database
+    load (bool): read the database now, otherwise `data` is None until `reload`
+    """
+
+    def __init__(self, path: str = "locations.db", load: bool = True) -> None:
+        self.path = path
+        self.loaded = Loaded(None, [], frozenset(), None)
+        if load:
+            self.reload()
+
+    @property
+    def data(self) -> ModelData:
+        return self.loaded.data
+
+    @property
+    def zip_codes(self) -> list:
+        return self.loaded.zip_codes
+
+    @property
+    def zip_code_set(self) -> frozenset:
+        return self.loaded.zip_code_set
+
+    def reload(self) -> ModelData:
+        """Re-reads the database and replaces the current data"""
+        mtime = os.path.getmtime(self.path)
+        conn = db.connect(self.path)
+        try:
+            with metrics.span("load"):
+                data = ModelData.from_db(conn)
+                zip_codes = utils.get_all_zip_codes(conn)
+        finally:
+            conn.close()
+        metrics.model_data_rows.set(len(data))
+        self.loaded = Loaded(data, zip_codes, frozenset(zip_codes), mtime)
+        return data
+
+    def refresh(self) -> bool:
+        """Reloads the data if the database file changed, returns True if it did"""
+        if os.path.getmtime(self.path) != self.loaded.mtime:
+            self.reload()
+            return True
+        return False
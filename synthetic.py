@@ -0,0 +1,81 @@
+"""
+Generates a synthetic locations.db with the same schema as the real one, for
+benchmarks and load tests that shouldn't depend on the real data.
+
+    python synthetic.py [path] [rows] [zip codes]
+"""
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+from store import FLAG_COLUMNS
+
+
+# roughly the Los Angeles area, also where loadtest.py and the model warm-up in
+# registry.py place their made-up locations
+LAT_RANGE = (33.70, 34.34)
+LON_RANGE = (-118.67, -118.15)
+FIRST_ZIP_CODE = 90001
+
+
+def make_db(
+    path: str = "synthetic.db", rows: int = 100000, zip_codes: int = 300, seed: int = 0
+) -> str:
+    """
+    Writes a database with `rows` random data points spread over `zip_codes` zip
+    codes (each zip code is a small area of its own). Overwrites `path`.
+
+    Arguments
+    ---------
+    path (str): where to write the database
+    rows (int): number of rows in `model_data`
+    zip_codes (int): number of distinct zip codes
+    seed (int): seed of the random data, the same seed gives the same database
+
+    Returns
+    -------
+    (str) the path of the database
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.array([str(FIRST_ZIP_CODE + i) for i in range(zip_codes)])
+    centers_lat = rng.uniform(*LAT_RANGE, zip_codes)
+    centers_lon = rng.uniform(*LON_RANGE, zip_codes)
+    # some zip codes have many more data points than others
+    weights = rng.pareto(1.5, zip_codes) + 1
+    zip_index = rng.choice(zip_codes, size=rows, p=weights / weights.sum())
+    lat = centers_lat[zip_index] + rng.normal(0, 0.01, rows)
+    lon = centers_lon[zip_index] + rng.normal(0, 0.01, rows)
+    flags = (rng.random((rows, len(FLAG_COLUMNS))) < 0.1).astype(int)
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(
+            "CREATE TABLE model_data (Start_Lat REAL, Start_Lng REAL, "
+            + "".join(f"{name} INTEGER, " for name in FLAG_COLUMNS)
+            + "Zip_Code TEXT);"
+        )
+        placeholders = ", ".join("?" * (len(FLAG_COLUMNS) + 3))
+        with conn:
+            conn.executemany(
+                f"INSERT INTO model_data VALUES ({placeholders});",
+                zip(lat.tolist(), lon.tolist(), *flags.T.tolist(), codes[zip_index].tolist()),
+            )
+            conn.execute("CREATE TABLE zip_codes (zip_code TEXT);")
+            conn.executemany("INSERT INTO zip_codes VALUES (?);", ((zc,) for zc in codes))
+    finally:
+        conn.close()
+    return path
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = make_db(
+        args[0] if len(args) > 0 else "synthetic.db",
+        rows=int(args[1]) if len(args) > 1 else 100000,
+        zip_codes=int(args[2]) if len(args) > 2 else 300,
+    )
+    print(f"wrote {path}")
@@ -0,0 +1,31 @@
+import pytest
+
+import synthetic
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """A small database with the schema of locations.db"""
+    path = tmp_path_factory.mktemp("db") / "synthetic.db"
+    return synthetic.make_db(str(path), rows=2000, zip_codes=20)
+
+
+@pytest.fixture
+def client(synthetic_db, tmp_path, monkeypatch):
+    """
+    Test client of the API serving the synthetic database and model.json. The
+    startup hook isn't run, the model and the data are loaded here instead.
+    """
+    from fastapi.testclient import TestClient
+
+    import main
+    from registry import ModelRegistry
+    from store import ModelDataStore
+
+    models = ModelRegistry(directory=str(tmp_path / "models"), engine="numpy")
+    models.refresh()
+    monkeypatch.setattr(main, "models", models)
+    monkeypatch.setattr(main, "store", ModelDataStore(synthetic_db))
+    monkeypatch.setitem(main.startup, "status", "ready")
+    main.prediction_cache.clear()
+    return TestClient(main.app)
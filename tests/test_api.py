@@ -0,0 +1,36 @@
+import numpy as np
+
+import utils
+
+
+def test_coords_batch_rejects_an_empty_batch(client):
+    response = client.post("/predict/coords/", json={"coordinates": []})
+    assert response.status_code == 422
+
+
+def test_live_zip_predictions_use_the_observed_weather(client, monkeypatch):
+    import main
+
+    observed = [(71.3, 57.0, 29.87, 6.2, 0.03), (71.4, 57.0, 29.87, 6.2, 0.03)]
+
+    async def get_weather_by_zip(zip_code, type_="tuple"):
+        return observed.pop(0)
+
+    monkeypatch.setattr(main.wt.async_client, "get_weather_by_zip", get_weather_by_zip)
+    first = client.get("/predict/zip/90001?live=true&format=columns").json()
+    assert tuple(first["weather"].values()) == (71.3, 57.0, 29.87, 6.2, 0.03)
+
+    data = main.store.data
+    expected = utils.predict_locations(
+        *data.columns(data.by_zip("90001")),
+        (71.3, 57.0, 29.87, 6.2, 0.03),
+        main.models.active.classifier,
+    )
+    np.testing.assert_allclose(
+        first["predictions"]["probability"], expected["probability"], rtol=1e-6
+    )
+
+    # same weather bucket: the cached predictions, with the weather they used
+    second = client.get("/predict/zip/90001?live=true&format=columns").json()
+    assert second["weather"] == first["weather"]
+    assert second["predictions"]["probability"] == first["predictions"]["probability"]
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+
+def test_cancelled_leader_does_not_fail_the_followers():
+    cache = TTLCache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def run():
+        leader = asyncio.ensure_future(cache.aget_or_compute("key", compute))
+        await asyncio.sleep(0)  # let the leader start the computation
+        follower = asyncio.ensure_future(cache.aget_or_compute("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "value"
+    assert calls == 1
+    assert cache.get("key") == "value"
+
+
+def test_followers_share_the_error():
+    cache = TTLCache()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("no weather")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.aget_or_compute("key", compute) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert cache.stats()["coalesced"] == 2
+    assert len(cache) == 0
@@ -0,0 +1,63 @@
+from datetime import datetime
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from classifier import (
+    SELECTED_FEATURES,
+    WEATHER_FEATURES,
+    Classifier,
+    InputData,
+    build_features,
+)
+from store import FLAG_COLUMNS
+
+
+@pytest.mark.parametrize("engine", ["xgboost", "numpy"])
+def test_score_empty_input(engine):
+    if engine == "xgboost":
+        pytest.importorskip("xgboost")
+    classifier = Classifier.load_model("model.json", engine=engine)
+    labels, probabilities = classifier.score(
+        np.empty((0, len(SELECTED_FEATURES)), dtype=np.float32)
+    )
+    assert labels.shape == (0,)
+    assert probabilities.shape == (0,)
+
+
+def test_xgboost_engine_without_xgboost(monkeypatch):
+    monkeypatch.setitem(sys.modules, "xgboost", None)  # makes the import fail
+    with pytest.raises(ImportError, match='engine="numpy"'):
+        Classifier.load_model("model.json", engine="xgboost")
+
+
+# a Sunday in December, and other weekdays and months
+TIMES = [
+    datetime(2023, 12, 31, 23, 15),
+    datetime(2024, 1, 1, 0, 0),
+    datetime(2024, 2, 29, 12, 30),
+    datetime(2024, 6, 14, 7, 45),
+    datetime(2024, 9, 7, 18, 5),
+]
+
+
+@pytest.mark.parametrize("when", TIMES)
+def test_build_features_matches_input_data(when):
+    rng = np.random.default_rng(when.toordinal())
+    rows = 6
+    lat = rng.uniform(33.7, 34.3, rows).astype(np.float32)
+    lon = rng.uniform(-118.7, -118.2, rows).astype(np.float32)
+    flags = {name: (rng.random(rows) < 0.5).astype(np.uint8) for name in FLAG_COLUMNS}
+    weather = (68.5, 61, 29.92, 4.47, 0.01)
+
+    frame = pd.DataFrame({"Start_Lat": lat, "Start_Lng": lon, **flags, "Zip_Code": "90001"})
+    frame[WEATHER_FEATURES] = weather
+    frame["Start_Time"] = when
+    expected = InputData(data=frame).data_ohe.to_numpy(np.float32)
+
+    assert np.array_equal(build_features(lat, lon, flags, weather, when), expected)
+    # one datetime64 per row takes the vectorized path
+    times = np.full(rows, np.datetime64(when, "s"))
+    assert np.array_equal(build_features(lat, lon, flags, weather, times), expected)
@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+
+import db
+
+
+def test_pool_gives_each_thread_its_own_connection(synthetic_db):
+    barrier = threading.Barrier(4)  # so that four different threads ask
+
+    def connection(_):
+        barrier.wait()
+        return id(pool.connection())
+
+    with db.ConnectionPool(synthetic_db) as pool:
+        with ThreadPoolExecutor(4) as executor:
+            assert len(set(executor.map(connection, range(4)))) == 4
+        assert pool.connection() is pool.connection()
+
+        lat, zip_code = pool.arrays(
+            "SELECT Start_Lat, Zip_Code FROM model_data;", dtypes=[np.float32, str]
+        )
+        (count,) = pool.execute("SELECT COUNT(*) FROM model_data;")[0]
+    assert lat.dtype == np.float32 and len(lat) == len(zip_code) == count
+    assert zip_code.dtype.kind == "U"
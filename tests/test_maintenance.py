@@ -0,0 +1,55 @@
+import sqlite3
+
+import db
+import maintenance
+import synthetic
+
+
+def test_migrate_makes_the_hot_queries_use_indexes(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=3000, zip_codes=20)
+    assert maintenance.check(path), "the unmigrated schema should need full scans"
+
+    maintenance.migrate(path)
+    assert maintenance.check(path) == []
+    conn = db.connect(path)
+    try:
+        plan = " ".join(
+            row[-1]
+            for row in conn.execute(
+                f"EXPLAIN QUERY PLAN {db.MODEL_DATA_BY_ZIP_QUERY}", ["90001"]
+            )
+        )
+    finally:
+        conn.close()
+    assert "COVERING INDEX idx_model_data_zip_code" in plan
+
+
+def test_migrate_is_idempotent(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=3000, zip_codes=20)
+    maintenance.migrate(path)
+    maintenance.migrate(path)
+    assert maintenance.check(path) == []
+
+
+def test_migrate_keeps_every_zip_codes_column(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=500, zip_codes=5)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("ALTER TABLE zip_codes ADD COLUMN city TEXT;")
+        conn.execute("UPDATE zip_codes SET city = 'Los Angeles';")
+        conn.execute("CREATE INDEX idx_zip_codes_city ON zip_codes(city);")
+    conn.close()
+
+    maintenance.migrate(path, wal=False)
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT zip_code, city FROM zip_codes;").fetchall()
+        indexes = [
+            name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")
+        ]
+        journal_mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+    finally:
+        conn.close()
+    assert len(rows) == 5 and all(city == "Los Angeles" for _, city in rows)
+    assert "idx_zip_codes_city" in indexes
+    assert journal_mode == "delete"
@@ -0,0 +1,23 @@
+import pytest
+
+import metrics
+
+
+def test_only_one_block_is_profiled_at_a_time():
+    with metrics.profile() as report:
+        with pytest.raises(metrics.ProfilerBusy):
+            with metrics.profile():
+                pass
+    assert report
+    with metrics.profile():  # released again
+        pass
+
+
+def test_busy_profiler_answers_409(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "PROFILING", True)
+    assert client.get("/zip_codes", headers={"X-Profile": "1"}).status_code == 200
+    with metrics.profile():
+        response = client.get("/zip_codes", headers={"X-Profile": "1"})
+    assert response.status_code == 409
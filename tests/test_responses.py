@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+import pytest
+
+import responses
+import utils
+
+
+def test_float32_coordinates_are_output_in_shortest_form():
+    columns = {
+        "lat": np.array([34.10215, 33.9], dtype=np.float32),
+        "lon": np.array([-118.3, -118.25], dtype=np.float32),
+        "probability": np.array([0.25, 0.75], dtype=np.float32),
+    }
+    records = utils.to_records(columns)
+    assert [r["lat"] for r in records] == [34.10215, 33.9]
+    assert [r["lon"] for r in records] == [-118.3, -118.25]
+    body = json.loads(responses.render("columns", columns, {}).body)
+    assert body["predictions"]["lat"] == [34.10215, 33.9]
+
+
+def test_arrow_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    columns = {
+        "lat": np.array([34.10215, 33.9], dtype=np.float32),
+        "label": np.array([0, 1], dtype=np.uint8),
+    }
+    response = responses.render("arrow", columns, {"Temperature(F)": 68.0})
+    assert response.media_type == responses.ARROW_MEDIA_TYPE
+    table = pa.ipc.open_stream(response.body).read_all()
+    assert table.column("lat").to_pylist() == columns["lat"].tolist()
+    assert table.column("label").to_pylist() == [0, 1]
+    assert json.loads(table.schema.metadata[b"weather"]) == {"Temperature(F)": 68.0}
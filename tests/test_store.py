@@ -0,0 +1,39 @@
+import sqlite3
+
+import numpy as np
+
+from store import ModelDataStore
+import synthetic
+import utils
+
+
+def test_rows_with_missing_values_are_left_out(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=500, zip_codes=5)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE model_data SET Bump = NULL WHERE rowid = 1;")
+        conn.execute("UPDATE model_data SET Start_Lat = NULL WHERE rowid = 2;")
+    conn.close()
+
+    store = ModelDataStore(path)
+    assert len(store.data) == 498
+    assert not np.isin([1, 2], store.data.rowid).any()
+
+    conn = utils.connect_to_db(path, debug=False)
+    try:
+        sample = utils.get_sample_rowids(conn)
+    finally:
+        conn.close()
+    assert np.array_equal(np.sort(sample), np.sort(store.data.rowid))
+
+
+def test_reload_replaces_the_data_and_zip_codes_together(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=500, zip_codes=5)
+    store = ModelDataStore(path)
+    before = store.loaded
+
+    synthetic.make_db(path, rows=300, zip_codes=3, seed=1)
+    store.reload()
+    assert store.loaded is not before
+    assert len(store.data) == 300
+    assert store.zip_code_set == frozenset(store.data.zip_codes.tolist())
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from classifier import TrainingData
+
+pytest.importorskip("xgboost")
+training = pytest.importorskip("training")
+
+
+def _training_csv(path, missing: list) -> pd.DataFrame:
+    data = pd.read_csv("sample_test_data.csv").head(40).reset_index(drop=True)
+    data["Target"] = np.arange(len(data)) % 2
+    for row, column in missing:
+        data.loc[row, column] = None
+    data.to_csv(path)
+    return data
+
+
+def _read(path) -> tuple:
+    chunks = list(training.iter_chunks(path, chunksize=16))
+    features = np.concatenate([features for features, _ in chunks])
+    target = np.concatenate([target for _, target in chunks])
+    return features, target
+
+
+def test_chunks_match_training_data(tmp_path):
+    path = tmp_path / "training.csv"
+    # rows with a missing value are dropped (the sample data has a few already),
+    # whether the model uses the column or not (Amenity)
+    data = _training_csv(path, [(3, "Amenity"), (7, "Humidity(%)"), (11, "Target")])
+
+    features, target = _read(path)
+    expected = TrainingData(path)
+    assert len(features) == len(data.dropna())
+    assert np.array_equal(features, expected.features.to_numpy(np.float32))
+    assert np.array_equal(target, expected.target.to_numpy())
+
+
+def test_missing_flags_are_dropped(tmp_path):
+    path = tmp_path / "training.csv"
+    data = _training_csv(path, [(3, "Junction"), (5, "Turning_Loop")])
+    features, target = _read(path)
+    assert len(features) == len(target) == len(data.dropna())
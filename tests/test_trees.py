@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pytest
+
+import trees
+
+
+def test_numpy_engine_matches_xgboost():
+    pytest.importorskip("xgboost")
+    assert trees.check_parity("model.json") < trees.PARITY_TOLERANCE
+
+
+def _tree(left, right, conditions, indices, default_left):
+    return {
+        "left_children": left,
+        "right_children": right,
+        "split_conditions": conditions,
+        "split_indices": indices,
+        "default_left": default_left,
+    }
+
+
+def test_hand_built_ensemble(tmp_path):
+    model = {
+        "learner": {
+            "objective": {"name": "binary:logistic"},
+            "learner_model_param": {"base_score": "5E-1"},  # a margin of 0
+            "gradient_booster": {
+                "model": {
+                    "trees": [
+                        # x0 < 1 ? 0.5 : -0.5, missing x0 goes right
+                        _tree([1, -1, -1], [2, -1, -1], [1.0, 0.5, -0.5], [0, 0, 0], [0, 0, 0]),
+                        # x1 < 0 ? 0.25 : (x0 < 2 ? 0.1 : -0.1), missing x1 goes
+                        # left and missing x0 right
+                        _tree(
+                            [1, -1, 3, -1, -1],
+                            [2, -1, 4, -1, -1],
+                            [0.0, 0.25, 2.0, 0.1, -0.1],
+                            [1, 0, 0, 0, 0],
+                            [1, 0, 0, 0, 0],
+                        ),
+                    ]
+                }
+            },
+        }
+    }
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(model))
+    ensemble = trees.TreeEnsemble.from_json(path)
+
+    data = np.array(
+        [
+            [1.0, 0.0],  # ties go right in both trees
+            [0.5, np.nan],
+            [np.nan, 1.0],
+            [3.0, -1.0],
+        ],
+        dtype=np.float32,
+    )
+    expected = np.array([-0.5 + 0.1, 0.5 + 0.25, -0.5 - 0.1, -0.5 + 0.25], dtype=np.float32)
+    assert ensemble.depth == 2
+    assert np.allclose(ensemble.predict_margin(data), expected)
+    assert np.allclose(ensemble.predict_proba(data), 1 / (1 + np.exp(-expected)))
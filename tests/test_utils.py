@@ -0,0 +1,26 @@
+import numpy as np
+
+import maintenance
+import sampling
+from store import ModelDataStore
+import synthetic
+import utils
+
+
+def test_sample_without_a_sample_table_is_the_stratified_sample(tmp_path):
+    path = synthetic.make_db(str(tmp_path / "locations.db"), rows=3000, zip_codes=20)
+    size = 500  # smaller than the table, so the fallback has to sample
+    conn = utils.connect_to_db(path, debug=False)
+    try:
+        unmigrated = utils.get_all_model_data(conn, sample=True, size=size)
+        maintenance.write_sample(conn, size)
+        stored = utils.get_all_model_data(conn, sample=True)
+    finally:
+        conn.close()
+    assert 0 < len(unmigrated) < 3000
+    assert unmigrated == stored
+
+    data = ModelDataStore(path).data
+    rows = sampling.stratified(data.zip_index, data.rowid, size)
+    # the store orders its rows by zip code
+    assert np.allclose(sorted(row[0] for row in unmigrated), np.sort(data.lat[rows]))
@@ -0,0 +1,156 @@
+"""
+Bins locations into map cells and summarises the predictions in each cell, so a
+map can be drawn from a few hundred cells instead of every data point. Two grids
+are supported:
+
+- `square`: the web map (slippy map) tiles of a zoom level
+- `geohash`: geohash cells with the precision closest in size to the tiles of a
+  zoom level
+"""
+import numpy as np
+
+
+GRIDS = ["square", "geohash"]
+GEOHASH_ALPHABET = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def geohash_precision(zoom: int) -> int:
+    """Geohash length whose cells are about as wide as the tiles of `zoom`"""
+    # a geohash of length p splits the longitudes into 2 ** ceil(5p / 2) cells,
+    # the tiles of zoom z into 2 ** z
+    return int(min(12, max(1, round(2 * zoom / 5))))
+
+
+def square_cells(lat: np.ndarray, lon: np.ndarray, zoom: int) -> np.ndarray:
+    """Returns the tile (x * 2**zoom + y) containing each location"""
+    n = 2**zoom
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lat = np.radians(lat)
+    x = np.floor((np.asarray(lon, dtype=np.float64) + 180) / 360 * n)
+    y = np.floor((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n)
+    x = np.clip(x, 0, n - 1).astype(np.int64)
+    y = np.clip(y, 0, n - 1).astype(np.int64)
+    return x * n + y
+
+
+def square_bounds(cells: np.ndarray, zoom: int) -> dict:
+    """Returns the `min_lat`, `min_lon`, `max_lat` and `max_lon` of each tile"""
+    n = 2**zoom
+    x, y = np.divmod(np.asarray(cells, dtype=np.int64), n)
+
+    def tile_lat(y):
+        return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+
+    return {
+        "min_lat": tile_lat(y + 1),
+        "min_lon": x / n * 360 - 180,
+        "max_lat": tile_lat(y),
+        "max_lon": (x + 1) / n * 360 - 180,
+    }
+
+
+def geohash_cells(lat: np.ndarray, lon: np.ndarray, precision: int) -> np.ndarray:
+    """Returns the geohash (as an integer of 5 * `precision` bits) of each location"""
+    lon_bits, lat_bits = _geohash_bits(precision)
+    x = _quantize(lon, -180, 360, lon_bits)
+    y = _quantize(lat, -90, 180, lat_bits)
+    code = np.zeros(len(x), dtype=np.int64)
+    # bits alternate longitude, latitude, longitude, ... from the most significant
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+    return code
+
+
+def geohash_bounds(cells: np.ndarray, precision: int) -> dict:
+    """Same as `square_bounds`, for geohash cells"""
+    lon_bits, lat_bits = _geohash_bits(precision)
+    cells = np.asarray(cells, dtype=np.int64)
+    x = np.zeros(len(cells), dtype=np.int64)
+    y = np.zeros(len(cells), dtype=np.int64)
+    for i in range(5 * precision):
+        bit = (cells >> (5 * precision - 1 - i)) & 1
+        if i % 2 == 0:
+            x = (x << 1) | bit
+        else:
+            y = (y << 1) | bit
+    lon_size, lat_size = 360 / 2**lon_bits, 180 / 2**lat_bits
+    return {
+        "min_lat": y * lat_size - 90,
+        "min_lon": x * lon_size - 180,
+        "max_lat": (y + 1) * lat_size - 90,
+        "max_lon": (x + 1) * lon_size - 180,
+    }
+
+
+def geohash_strings(cells: np.ndarray, precision: int) -> list:
+    """Returns the base32 string of each geohash cell"""
+    cells = np.asarray(cells, dtype=np.int64)
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    digits = GEOHASH_ALPHABET[(cells[:, None] >> shifts) & 31]
+    return ["".join(row) for row in digits.tolist()]
+
+
+def aggregate(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    label: np.ndarray,
+    probability: np.ndarray,
+    grid: str = "square",
+    zoom: int = 12,
+) -> dict:
+    """
+    Groups the predictions by cell
+
+    Arguments
+    ---------
+    lat (np.ndarray): latitude of each prediction
+    lon (np.ndarray): longitude of each prediction
+    label (np.ndarray): 0/1 label of each prediction
+    probability (np.ndarray): probability of each prediction
+    grid (str): `square` or `geohash`
+    zoom (int): web map zoom level the cells are sized for
+
+    Returns
+    -------
+    dict of columns with one row per non-empty cell: `cell` (tile "zoom/x/y" or
+    geohash), the cell bounds, `count`, `mean_probability` and `high_risk_fraction`
+    """
+    if grid == "square":
+        keys = square_cells(lat, lon, zoom)
+    elif grid == "geohash":
+        keys = geohash_cells(lat, lon, geohash_precision(zoom))
+    else:
+        raise ValueError(f"grid must be one of {', '.join(GRIDS)}, not '{grid}'")
+
+    cells, inverse = np.unique(keys, return_inverse=True)
+    count = np.bincount(inverse, minlength=len(cells))
+    probability_sum = np.bincount(inverse, weights=probability, minlength=len(cells))
+    high_risk = np.bincount(inverse, weights=label, minlength=len(cells))
+
+    if grid == "square":
+        x, y = np.divmod(cells, 2**zoom)
+        columns = {"cell": [f"{zoom}/{i}/{j}" for i, j in zip(x.tolist(), y.tolist())]}
+        columns.update(square_bounds(cells, zoom))
+    else:
+        precision = geohash_precision(zoom)
+        columns = {"cell": geohash_strings(cells, precision)}
+        columns.update(geohash_bounds(cells, precision))
+    columns["count"] = count
+    columns["mean_probability"] = probability_sum / count
+    columns["high_risk_fraction"] = high_risk / count
+    return columns
+
+
+def _geohash_bits(precision: int) -> tuple:
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def _quantize(value: np.ndarray, start: float, span: float, bits: int) -> np.ndarray:
+    cells = np.floor((np.asarray(value, dtype=np.float64) - start) / span * 2**bits)
+    return np.clip(cells, 0, 2**bits - 1).astype(np.int64)
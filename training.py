@@ -0,0 +1,148 @@
+"""
+Out-of-core training. `TrainingData` reads the whole CSV into memory and one-hot
+encodes every column; this reads the CSV a chunk at a time with compact dtypes,
+builds the `SELECTED_FEATURES` matrix of each chunk directly (see
+`classifier.build_features`) and feeds the chunks to XGBoost through a
+`DataIter`, so the size of the training data is limited by disk, not RAM.
+
+    python training.py [la_final_data.csv] [model.json]
+"""
+import os
+import sys
+import tempfile
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from classifier import FLAG_FEATURES, SELECTED_FEATURES, WEATHER_FEATURES, build_features
+
+
+# compact dtypes of the columns the model uses; the flags and the target are read
+# as nullable types, a plain bool or int column can't hold the missing values
+# `dropna` removes
+DTYPES = {
+    "Start_Lat": "float32",
+    "Start_Lng": "float32",
+    **{name: "float32" for name in WEATHER_FEATURES},
+    **{name: "boolean" for name in FLAG_FEATURES},
+    "Target": "Int8",
+}
+
+# the parameters prediction.py trains with (found through cross validation);
+# XGBClassifier leaves tree_method to XGBoost 1.7, which picks the exact method
+# unless the data is very large, but chunks can only be trained on with hist (or
+# approx), so the splits are searched over quantiles and the trees differ slightly
+PARAMS = {
+    "objective": "binary:logistic",
+    "tree_method": "hist",
+    "max_depth": 7,
+    "min_child_weight": 1,
+    "colsample_bytree": 0.75,
+}
+NUM_BOOST_ROUND = 100
+
+
+def iter_chunks(path: Union[str, os.PathLike], chunksize: int = 100000):
+    """
+    Reads the training CSV `chunksize` rows at a time, dropping rows with missing
+    values in any column (as `TrainingData` does, so every column is read). Yields
+    the (n, 20) float32 feature matrix and the target of each chunk.
+    """
+    reader = pd.read_csv(path, dtype=DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        chunk.dropna(axis=0, inplace=True)
+        if chunk.empty:
+            continue
+        features = build_features(
+            chunk["Start_Lat"].to_numpy(),
+            chunk["Start_Lng"].to_numpy(),
+            {name: chunk[name].to_numpy(dtype=bool) for name in FLAG_FEATURES},
+            chunk[WEATHER_FEATURES].to_numpy(),
+            pd.to_datetime(chunk["Start_Time"]).to_numpy(dtype="datetime64[s]"),
+        )
+        yield features, chunk["Target"].to_numpy(dtype=np.int8)
+
+
+class ChunkIter(xgb.DataIter):
+    """
+    Feeds the chunks of `iter_chunks` to XGBoost. With a `cache_prefix`, a
+    `DMatrix` built from this iterator keeps its pages on disk (external memory).
+
+    Arguments
+    ---------
+    path (str): path to the training CSV
+    chunksize (int): number of CSV rows per chunk
+    cache_prefix (str): where XGBoost writes its external memory cache
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        chunksize: int = 100000,
+        cache_prefix: str = None,
+    ) -> None:
+        self.path = path
+        self.chunksize = chunksize
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+        if self._chunks is None:
+            self._chunks = iter_chunks(self.path, self.chunksize)
+        try:
+            features, target = next(self._chunks)
+        except StopIteration:
+            return 0
+        input_data(data=features, label=target, feature_names=SELECTED_FEATURES)
+        return 1
+
+    def reset(self) -> None:
+        self._chunks = None
+
+
+def train(
+    path: Union[str, os.PathLike] = "la_final_data.csv",
+    chunksize: int = 100000,
+    external_memory: bool = True,
+    cache_dir: str = None,
+    params: dict = None,
+    num_boost_round: int = NUM_BOOST_ROUND,
+) -> xgb.Booster:
+    """
+    Trains the model on the CSV a chunk at a time
+
+    Arguments
+    ---------
+    path (str): path to the training CSV
+    chunksize (int): number of CSV rows per chunk
+    external_memory (bool): keep the training data on disk (in `cache_dir`)
+    instead of building a compressed, quantized copy of it in memory
+    cache_dir (str): directory for the external memory cache (a temporary
+    directory by default)
+    params (dict): XGBoost parameters (defaults to `PARAMS`)
+    num_boost_round (int): number of trees
+
+    Returns
+    -------
+    (xgb.Booster) the trained model, `Booster.save_model` writes a model.json
+    `Classifier.load_model` can read
+    """
+    params = {**PARAMS, **(params or {})}
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+        if external_memory:
+            it = ChunkIter(path, chunksize, cache_prefix=os.path.join(tmp, "cache"))
+            dtrain = xgb.DMatrix(it)
+        else:
+            dtrain = xgb.QuantileDMatrix(ChunkIter(path, chunksize))
+        booster = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+        del dtrain  # XGBoost removes its cache files before the directory goes
+    return booster
+
+
+if __name__ == "__main__":
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "la_final_data.csv"
+    model_path = sys.argv[2] if len(sys.argv) > 2 else "model.json"
+    train(data_path).save_model(model_path)
+    print(f"saved {model_path}")
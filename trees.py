@@ -0,0 +1,213 @@
+"""
+Pure NumPy evaluator for the gradient boosted trees saved in model.json. Lets the
+API serve predictions without loading XGBoost; see `Classifier.load_model`.
+
+Running this module checks the evaluator against XGBoost:
+
+    python trees.py [model.json]
+"""
+import json
+from os import PathLike
+import sys
+from typing import Union
+
+import numpy as np
+
+
+# largest difference from XGBoost's probabilities `check_parity` accepts
+PARITY_TOLERANCE = 1e-5
+
+
+class TreeEnsemble:
+    """
+    The trees of a `binary:logistic` XGBoost model as flat node arrays with one
+    row per tree (padded to the largest tree). Leaves point to themselves, so
+    every row can be moved down one level of every tree at once.
+
+    Arguments
+    ---------
+    feature (np.ndarray): feature index each node splits on
+    threshold (np.ndarray): split condition, rows with `x < threshold` go left
+    left (np.ndarray): index of each node's left child
+    right (np.ndarray): index of each node's right child
+    default_left (np.ndarray): whether missing values go left
+    value (np.ndarray): leaf values (0 for inner nodes)
+    base_margin (float): margin every prediction starts from
+    depth (int): depth of the deepest tree
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        default_left: np.ndarray,
+        value: np.ndarray,
+        base_margin: float,
+        depth: int,
+    ) -> None:
+        n_trees, n_nodes = feature.shape
+        # flattened so that node j of tree i is at i * n_nodes + j
+        offsets = (np.arange(n_trees, dtype=np.int32) * n_nodes)[:, None]
+        self.feature = feature.ravel()
+        self.threshold = threshold.ravel()
+        self.left = (left + offsets).ravel()
+        self.right = (right + offsets).ravel()
+        self.default_left = default_left.ravel()
+        self.value = value.ravel()
+        self.roots = offsets.ravel()
+        self.base_margin = base_margin
+        self.depth = depth
+
+    @classmethod
+    def from_json(cls, path: Union[str, PathLike] = "model.json") -> "TreeEnsemble":
+        """Parses a model saved with `Classifier.save_model` (JSON format)"""
+        with open(path) as f:
+            learner = json.load(f)["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "binary:logistic":
+            raise ValueError(f"only binary:logistic models are supported, not {objective}")
+
+        trees = learner["gradient_booster"]["model"]["trees"]
+        n_nodes = max(len(tree["left_children"]) for tree in trees)
+        shape = (len(trees), n_nodes)
+        feature = np.zeros(shape, dtype=np.int32)
+        threshold = np.zeros(shape, dtype=np.float32)
+        left = np.tile(np.arange(n_nodes, dtype=np.int32), (len(trees), 1))
+        right = left.copy()
+        default_left = np.zeros(shape, dtype=bool)
+        value = np.zeros(shape, dtype=np.float32)
+        depth = 0
+        for i, tree in enumerate(trees):
+            lc = np.array(tree["left_children"], dtype=np.int32)
+            rc = np.array(tree["right_children"], dtype=np.int32)
+            conditions = np.array(tree["split_conditions"], dtype=np.float32)
+            inner = lc != -1
+            m = len(lc)
+            feature[i, :m] = np.where(inner, tree["split_indices"], 0)
+            threshold[i, :m] = np.where(inner, conditions, 0)
+            left[i, :m] = np.where(inner, lc, np.arange(m))
+            right[i, :m] = np.where(inner, rc, np.arange(m))
+            default_left[i, :m] = np.array(tree["default_left"], dtype=bool)
+            # leaves keep their value in split_conditions
+            value[i, :m] = np.where(inner, 0, conditions)
+            depth = max(depth, _tree_depth(lc, rc))
+
+        base_score = float(learner["learner_model_param"]["base_score"])
+        return cls(
+            feature=feature,
+            threshold=threshold,
+            left=left,
+            right=right,
+            default_left=default_left,
+            value=value,
+            base_margin=float(np.log(base_score / (1 - base_score))),
+            depth=depth,
+        )
+
+    def save(self, path: Union[str, PathLike]) -> None:
+        """
+        Saves the node arrays as an .npz, which `load` reads much faster than
+        `from_json` parses the model
+        """
+        n_trees = len(self.roots)
+        shape = (n_trees, len(self.feature) // n_trees)
+        offsets = self.roots[:, None]
+        np.savez(
+            path,
+            feature=self.feature.reshape(shape),
+            threshold=self.threshold.reshape(shape),
+            left=self.left.reshape(shape) - offsets,
+            right=self.right.reshape(shape) - offsets,
+            default_left=self.default_left.reshape(shape),
+            value=self.value.reshape(shape),
+            base_margin=self.base_margin,
+            depth=self.depth,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, PathLike]) -> "TreeEnsemble":
+        """Loads an ensemble saved with `save`"""
+        with np.load(path) as arrays:
+            return cls(
+                feature=arrays["feature"],
+                threshold=arrays["threshold"],
+                left=arrays["left"],
+                right=arrays["right"],
+                default_left=arrays["default_left"],
+                value=arrays["value"],
+                base_margin=float(arrays["base_margin"]),
+                depth=int(arrays["depth"]),
+            )
+
+    def predict_margin(self, data: np.ndarray, batch_size: int = 4096) -> np.ndarray:
+        """
+        Returns the raw (untransformed) score of every row of the feature matrix,
+        i.e. what XGBoost returns with `output_margin=True`
+        """
+        data = np.asarray(data, dtype=np.float32)
+        margin = np.empty(len(data), dtype=np.float32)
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size]
+            rows = np.arange(len(batch))[:, None]
+            node = np.broadcast_to(self.roots, (len(batch), len(self.roots)))
+            missing = np.isnan(batch).any()
+            for _ in range(self.depth):
+                x = batch[rows, self.feature[node]]
+                go_left = x < self.threshold[node]
+                if missing:
+                    go_left = np.where(np.isnan(x), self.default_left[node], go_left)
+                node = np.where(go_left, self.left[node], self.right[node])
+            margin[start:start + batch_size] = (
+                self.value[node].sum(axis=1, dtype=np.float32) + self.base_margin
+            )
+        return margin
+
+    def predict_proba(self, data: np.ndarray) -> np.ndarray:
+        """Returns the probability of the positive class (1) for every row"""
+        margin = self.predict_margin(data)
+        return (1 / (1 + np.exp(-margin))).astype(np.float32)
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    # children are always stored after their parent
+    depth = np.zeros(len(left), dtype=np.int32)
+    for node in range(len(left)):
+        if left[node] != -1:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def check_parity(
+    path: Union[str, PathLike] = "model.json", n: int = 20000, seed: int = 0
+) -> float:
+    """
+    Compares `TreeEnsemble` probabilities with XGBoost's on random inputs drawn
+    around the model's split conditions (including exact ties and missing values)
+    and returns the largest absolute difference.
+    """
+    from xgboost import Booster
+
+    booster = Booster()
+    booster.load_model(path)
+    ensemble = TreeEnsemble.from_json(path)
+    n_features = int(booster.num_features())
+
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(n, n_features)).astype(np.float32)
+    for j in range(n_features):
+        conditions = ensemble.threshold[(ensemble.feature == j) & (ensemble.value == 0)]
+        if len(conditions):
+            offsets = rng.choice([-1e-3, 0, 1e-3], size=n).astype(np.float32)
+            data[:, j] = rng.choice(conditions, size=n) + offsets
+    data[rng.random(data.shape) < 0.01] = np.nan
+
+    expected = booster.inplace_predict(data)
+    return float(np.abs(ensemble.predict_proba(data) - expected).max())
+
+
+if __name__ == "__main__":
+    diff = check_parity(*sys.argv[1:2])
+    print(f"max absolute difference from XGBoost: {diff:.3g}")
+    sys.exit(0 if diff < PARITY_TOLERANCE else 1)
@@ -1,11 +1,25 @@
 from datetime import datetime
+import itertools
+import json
 import math
 import os
 import sqlite3
 
+import numpy as np
 import pandas as pd
 
-from classifier import Classifier, InputData
+from classifier import Classifier, InputData, build_features
+import db
+import metrics
+import sampling
+
+
+EARTH_RADIUS = {"metric": 6371, "imperial": 3956}
+# step each weather value (temperature, humidity, pressure, wind speed and
+# precipitation) is rounded to by `quantize_weather`
+WEATHER_QUANTUM = (1.0, 1.0, 0.01, 0.5, 0.01)
+# columns of the prediction output holding coordinates, see `widen_coordinates`
+COORDINATE_COLUMNS = ("lat", "lon")
 
 
 def create_db(db_name: str) -> sqlite3.Connection:
@@ -57,17 +71,25 @@ def dict_factory(cursor: sqlite3.Cursor, row: sqlite3.Row) -> dict:
     return {key: value for key, value in zip(col_names, row)}
 
 
-def get_all_model_data(conn: sqlite3.Connection, type_: str = "list") -> list:
+def get_all_model_data(
+    conn: sqlite3.Connection, type_: str = "list", sample: bool = True, size: int = None
+) -> list:
     """
     Returns all model data.
 
-    NOTE: this is currently limited to 100,000 randomly selected data points for
-    performance reasons
+    NOTE: by default this is limited to the stratified sample (see sampling.py)
+    for performance reasons, read from the `model_data_sample` table, or
+    computed from the rowids and zip codes if the database has no such table
+    (`make migrate` stores it) or a `size` is given. Use `sample=False` to get
+    every data point.
 
     Arguments
     ---------
     conn (sqlite3.Connection): connection to the database
     type_ (str): the type of the returned data (defaults to list)
+    sample (bool): only return the sampled data points
+    size (int): about how many data points to sample, defaults to the stored
+    sample, or `sampling.SAMPLE_SIZE` without one
 
     Returns
     -------
@@ -92,18 +114,53 @@ def get_all_model_data(conn: sqlite3.Connection, type_: str = "list") -> list:
         Turning_Loop,
         Zip_Code
     FROM model_data
-    ORDER BY RANDOM()
-    LIMIT 100000;
     """
-    with conn:
-        results = conn.execute(query).fetchall()
+    params = []
+    if sample and size is None and conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'model_data_sample';"
+    ).fetchone():
+        query += "WHERE rowid IN (SELECT row_id FROM model_data_sample)"
+    elif sample:
+        query += "WHERE rowid IN (SELECT value FROM json_each(?))"
+        params = [json.dumps(get_sample_rowids(conn, size).tolist())]
+    with conn, metrics.span("sql"):
+        results = conn.execute(query, params).fetchall()
 
     if type_ == "pd":
         results = pd.DataFrame(results)
     return results
 
 
-def get_closest_match(conn: sqlite3.Connection, location: tuple) -> tuple:
+def get_sample_rowids(conn: sqlite3.Connection, size: int = None) -> np.ndarray:
+    """
+    Returns the rowids of the stratified sample of the complete rows of
+    `model_data` (see `sampling.stratified`), the rows
+    `ModelData.sample("stratified")` picks
+
+    Arguments
+    ---------
+    conn (sqlite3.Connection): connection to the database
+    size (int): about how many rows to sample, `sampling.SAMPLE_SIZE` if None
+
+    Returns
+    -------
+    (np.ndarray) the sampled rowids
+    """
+    rowid, zip_codes = db.arrays(
+        conn,
+        f"SELECT rowid, Zip_Code FROM model_data WHERE {db.COMPLETE_ROWS};",
+        dtypes=[np.int64, str],
+    )
+    size = sampling.SAMPLE_SIZE if size is None else size
+    return rowid[sampling.stratified(zip_codes, rowid, size)]
+
+
+def get_closest_match(
+    conn: sqlite3.Connection,
+    location: tuple,
+    index=None,
+    data: pd.DataFrame = None,
+) -> tuple:
     """
     Finds the model data point that most closely matches the given latitude-longitude
     pair. NOTE: May be highly inaccurate because the closest data point may be only a
@@ -113,11 +170,19 @@ def get_closest_match(conn: sqlite3.Connection, location: tuple) -> tuple:
     ---------
     conn (sqlite3.Connection): connection to the database
     location (tuple): latitude-longitude pair
+    index (spatial.SpatialIndex): spatial index built over `data`. If given, the
+    exact nearest point is looked up in the index instead of scanning the database
+    data (pd.DataFrame): the model data the index was built from
 
     Returns
     -------
-    (tuple): a tuple of the closest matching data point (could be off by miles)
+    (tuple): a tuple of the distance (in miles) and the closest matching data point
+    (could be off by miles)
     """
+    if index is not None:
+        dist, idx = index.nearest(location)
+        return dist[0], data.iloc[idx[0]].to_dict()
+
     distances = [
         (distance(location, (datum["Start_Lat"], datum["Start_Lng"])), datum)
         for datum in get_all_model_data(conn)
@@ -151,8 +216,7 @@ def distance(loc1: tuple, loc2: tuple, units: str = "imperial") -> float:
     )
     d = 2 * math.asin(math.sqrt(d))
 
-    earth_radius = {"metric": 6371, "imperial": 3956}
-    d *= earth_radius[units]
+    d *= EARTH_RADIUS[units]
     return d
 
 
@@ -169,10 +233,8 @@ def get_all_zip_codes(conn: sqlite3.Connection) -> list:
     list of all zip codes in the database
     """
     query = "SELECT zip_code FROM zip_codes;"
-    with conn:
-        zips = conn.execute(query).fetchall()
-
-    return [zc["zip_code"] for zc in zips]
+    cursor = db.tuple_cursor(conn)
+    return [zc for zc, in cursor.execute(query)]
 
 
 def make_prediction(
@@ -188,11 +250,249 @@ def make_prediction(
     ]
     location[columns] = weather
     location["Start_Time"] = datetime.now()
-    idata = InputData(data=location)
+    with metrics.span("input_data"):
+        idata = InputData(data=location)
     prediction = classifier.predict(idata.data_ohe, idata.index, type_="list")
     return prediction
 
 
+def predict_locations(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    flags: dict,
+    weather: tuple,
+    classifier: Classifier,
+    when: datetime = None,
+    threshold: float = 0.5,
+) -> dict:
+    """
+    Same as `make_prediction`, but takes the locations as arrays (e.g. from
+    `store.ModelData.columns`), builds the model input without a DataFrame and
+    returns the prediction column by column. Use `to_records` to get the same
+    list of dicts `make_prediction` returns.
+
+    Arguments
+    ---------
+    lat (np.ndarray): latitude of each location
+    lon (np.ndarray): longitude of each location
+    flags (dict): maps the location flags (Junction, Railway, ...) to arrays
+    weather (tuple): weather values shared by every location, or an array with
+    one row of weather values per location (see `weather_by_row`)
+    classifier (Classifier): the model
+    when (datetime): the time the prediction is for (defaults to now)
+    threshold (float): locations whose probability is above this are labelled 1
+
+    Returns
+    -------
+    dict of the `time`, `lat`, `lon`, `label` and `probability` columns
+    """
+    when = datetime.now() if when is None else when
+    with metrics.span("features"):
+        features = build_features(lat, lon, flags, weather, when)
+    labels, probabilities = classifier.score(features, threshold=threshold)
+    return {
+        "time": when,
+        "lat": lat,
+        "lon": lon,
+        "label": labels,
+        "probability": probabilities,
+    }
+
+
+def predict_forecast(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    flags: dict,
+    times: np.ndarray,
+    weather: np.ndarray,
+    classifier: Classifier,
+    threshold: float = 0.5,
+) -> dict:
+    """
+    Predicts every location at every forecast step. The locations x steps pairs
+    are laid out as one feature matrix (location-major) and scored at once.
+
+    Arguments
+    ---------
+    lat (np.ndarray): latitude of each location
+    lon (np.ndarray): longitude of each location
+    flags (dict): maps the location flags (Junction, Railway, ...) to arrays
+    times (np.ndarray): datetime64 array, the time of each step
+    weather (np.ndarray): one row of weather values per step
+    classifier (Classifier): the model
+    threshold (float): locations whose probability is above this are labelled 1
+
+    Returns
+    -------
+    dict of the `lat` and `lon` columns and the `label` and `probability` columns,
+    which have one row per location and one column per step
+    """
+    n, steps = len(lat), len(times)
+    with metrics.span("features"):
+        features = build_features(
+            np.repeat(lat, steps),
+            np.repeat(lon, steps),
+            {name: np.repeat(flag, steps) for name, flag in flags.items()},
+            np.tile(weather, (n, 1)),
+            np.tile(times, n),
+        )
+    labels, probabilities = classifier.score(features, threshold=threshold)
+    return {
+        "lat": lat,
+        "lon": lon,
+        "label": labels.reshape(n, steps),
+        "probability": probabilities.reshape(n, steps),
+    }
+
+
+def quantize_weather(weather: tuple, quantum: tuple = WEATHER_QUANTUM) -> tuple:
+    """
+    Rounds each weather value to a multiple of its step in `quantum`, so that
+    nearly identical weather maps to the same tuple (e.g. in a cache key)
+    """
+    return tuple(round(round(value / step) * step, 2) for value, step in zip(weather, quantum))
+
+
+def prediction_key(location, weather: tuple, when: datetime) -> tuple:
+    """
+    Returns a cache key for the predictions of a set of locations (a zip code, a
+    grid cell, ...): every model input except the locations themselves comes from
+    the quantized weather and the month, hour and day of the week of `when`. The
+    quantized weather is only used for the key; the predictions are made with the
+    observed weather, and a cache hit returns those made with the weather of the
+    first lookup in the bucket (store it with them to report it).
+    """
+    return location, quantize_weather(weather), when.month, when.hour, when.weekday()
+
+
+def to_records(columns: dict) -> list:
+    """
+    Converts a dict of columns (arrays, or scalars shared by every row) to a list
+    of dicts, one per row
+
+    Arguments
+    ---------
+    columns (dict): the columns, e.g. from `predict_locations`
+
+    Returns
+    -------
+    list of dicts, one per row
+    """
+    keys = list(columns)
+    values = []
+    for key, value in columns.items():
+        if np.ndim(value) == 0:
+            values.append(itertools.repeat(value))
+        elif key in COORDINATE_COLUMNS:
+            values.append(widen_coordinates(value).tolist())
+        else:
+            values.append(np.asarray(value).tolist())
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def widen_coordinates(values) -> np.ndarray:
+    """
+    Converts float32 coordinates (see `store.ModelData`) to the float64 of their
+    shortest decimal representation, so they are output as e.g. 34.10215 rather
+    than 34.102149963378906. Other dtypes are returned as they are.
+    """
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        return values
+    return values.astype(str).astype(np.float64)
+
+
+def weather_by_row(data, rows, zip_weather: dict, default: tuple = None) -> np.ndarray:
+    """
+    Looks up the weather of each row's zip code
+
+    Arguments
+    ---------
+    data (store.ModelData): the model data
+    rows (np.ndarray): indices (or a slice) of the rows
+    zip_weather (dict): maps zip codes to weather tuples
+    default (tuple): weather for zip codes that aren't in `zip_weather` (NaN, i.e.
+    missing, if not given)
+
+    Returns
+    -------
+    (np.ndarray) one row of weather values per row of data
+    """
+    return weather_by_key(
+        data.zip_codes.tolist(), data.zip_index[rows], zip_weather, default
+    )
+
+
+def weather_by_key(
+    keys: list, inverse: np.ndarray, key_weather: dict, default: tuple = None
+) -> np.ndarray:
+    """
+    Expands the weather of a few keys (zip codes, grid cells from
+    `weather.grid_cells`, ...) to the rows that share them
+
+    Arguments
+    ---------
+    keys (list): the distinct keys
+    inverse (np.ndarray): position of each row's key in `keys`
+    key_weather (dict): maps keys to weather tuples
+    default (tuple): weather for keys that aren't in `key_weather` (NaN, i.e.
+    missing, if not given)
+
+    Returns
+    -------
+    (np.ndarray) one row of weather values per row
+    """
+    table = np.full((len(keys), 5), np.nan)
+    if default is not None:
+        table[:] = default
+    for i, key in enumerate(keys):
+        if key in key_weather:
+            table[i] = key_weather[key]
+    return table[inverse]
+
+
+def iter_predictions(
+    data,
+    rows: np.ndarray,
+    weather: tuple,
+    classifier: Classifier,
+    when: datetime = None,
+    threshold: float = 0.5,
+    chunk_size: int = 10000,
+):
+    """
+    Scores the given rows of the model data `chunk_size` rows at a time, so only
+    one chunk of predictions is held in memory at once
+
+    Arguments
+    ---------
+    data (store.ModelData): the model data
+    rows (np.ndarray): indices of the rows to score
+    weather (tuple): weather values shared by every location, or an array with
+    one row of weather values per row in `rows`
+    classifier (Classifier): the model
+    when (datetime): the time the prediction is for (defaults to now)
+    threshold (float): locations whose probability is above this are labelled 1
+    chunk_size (int): number of rows scored at a time
+
+    Yields
+    ------
+    dict of the prediction columns (see `predict_locations`) plus `zip_code` for
+    each chunk
+    """
+    when = datetime.now() if when is None else when
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        chunk_weather = weather
+        if np.ndim(weather) == 2:
+            chunk_weather = weather[start:start + chunk_size]
+        prediction = predict_locations(
+            *data.columns(chunk), chunk_weather, classifier, when=when, threshold=threshold
+        )
+        prediction["zip_code"] = data.zip_codes[data.zip_index[chunk]]
+        yield prediction
+
+
 def get_model_data_by_zip(
     conn: sqlite3.Connection, zip_code: str, type_: str = "list"
 ) -> list:
@@ -210,28 +510,8 @@ def get_model_data_by_zip(
     (type_) of dicts of the model data belonging to the given zip code
 
     """
-    query = """
-    SELECT
-        Start_Lat,
-        Start_Lng,
-        Amenity,
-        Bump,
-        Crossing,
-        Give_Way,
-        Junction,
-        No_Exit,
-        Railway,
-        Roundabout,
-        Station,
-        Stop,
-        Traffic_Calming,
-        Traffic_Signal,
-        Turning_Loop,
-        Zip_Code
-    FROM model_data
-    WHERE zip_code = ?;
-    """
-    with conn:
+    query = db.MODEL_DATA_BY_ZIP_QUERY
+    with conn, metrics.span("sql"):
         results = conn.execute(query, [zip_code]).fetchall()
 
     if type_ == "pd":
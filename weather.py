@@ -1,100 +1,117 @@
+import asyncio
 from collections import namedtuple
-# from functools import lru_cache
 import os
 
 from dotenv import load_dotenv
+import httpx
+import numpy as np
 import pandas as pd
-import pyowm
 
-# from utils import cache_maintainer
+from cache import TTLCache
+import metrics
 
 
 # load the OpenWeatherMap API key
 load_dotenv()
 
 
-owm = pyowm.OWM(os.environ.get("OWM_API_KEY"))
-owm_mgr = owm.weather_manager()
+# pyowm client of the synchronous functions, built by `weather_manager` on first
+# use (the API's handlers use `async_client` instead)
+owm = None
+owm_mgr = None
 City = namedtuple("City", ["id", "lat", "lon"])
 los_angeles = City(id=5368361, lat=34.052231, lon=-118.243683)
 
+COLUMNS = [
+    "Temperature(F)",
+    "Humidity(%)",
+    "Pressure(in)",
+    "Wind_Speed(mph)",
+    "Precipitation(in)",
+]
 
-# @cache_maintainer(3600)  # cache for one hour
-# @lru_cache(maxsize=1000)
-def get_weather_by_lat_lon(lat, lon, type_="pd") -> pd.DataFrame:
-    """ """
-    if type_ not in ["dict", "pd"]:
-        raise ValueError(f"type_ must be either 'pd' or 'dict', not '{type_}'")
+# root URL of the OpenWeatherMap API the async client calls, e.g. a local
+# owm_stub.py for load tests
+OWM_BASE_URL = os.environ.get("OWM_BASE_URL", "https://api.openweathermap.org")
+KELVIN_OFFSET = 273.15
+MPH_PER_METER_SEC = 2.23694
+PRESSURE_CONVERSION = 0.014503773773020924
 
-    weather = owm_mgr.one_call(lat=lat, lon=lon, units="imperial").current
-    temperature = weather.temp["temp"]  # fahrenheit
-    humidity = weather.humidity  # in %
-    pressure_conversion = 0.014503773773020924
-    pressure = (
-        weather.barometric_pressure("hPa")["press"] * pressure_conversion
-    )  # in hPa
-    wind_speed = weather.wind("miles_hour")["speed"]  # in mph
-    precipitation = get_rain(weather.rain)  # inches
+# weather for a latitude-longitude pair is cached per grid cell, i.e. the pair
+# rounded to this many decimal places (2 -> cells of roughly 1km)
+GRID_PRECISION = int(os.environ.get("WEATHER_GRID_PRECISION", 2))
+weather_cache = TTLCache(
+    ttl=float(os.environ.get("WEATHER_CACHE_TTL", 3600)),  # cache for one hour
+    maxsize=int(os.environ.get("WEATHER_CACHE_SIZE", 1000)),
+)
 
-    if type_ == "pd":
-        columns = [
-            "Temperature(F)",
-            "Humidity(%)",
-            "Pressure(in)",
-            "Wind_Speed(mph)",
-            "Precipitation(in)",
-        ]
-        weather_df = pd.DataFrame(columns=columns, index=[0])
-        weather_df[columns] = temperature, humidity, pressure, wind_speed, precipitation
-        return weather_df
-    elif type_ == "dict":
-        return {
-            "Temperature(F)": temperature,
-            "Humidity(%)": humidity,
-            "Pressure(in)": pressure,
-            "Wind_Speed(mph)": wind_speed,
-            "Precipitation(in)": precipitation,
-        }
+
+def weather_manager():
+    """
+    Returns the pyowm weather manager, creating the client on first use since
+    pyowm is slow to import
+    """
+    global owm, owm_mgr
+    if owm_mgr is None:
+        import pyowm
+
+        owm = pyowm.OWM(os.environ.get("OWM_API_KEY"))
+        owm_mgr = owm.weather_manager()
+    return owm_mgr
+
+
+def grid_cell(lat: float, lon: float) -> tuple:
+    """
+    Returns the weather grid cell (the rounded latitude-longitude pair) that the
+    given location falls in
+    """
+    return round(lat, GRID_PRECISION), round(lon, GRID_PRECISION)
+
+
+def grid_cells(lat: np.ndarray, lon: np.ndarray, precision: int = GRID_PRECISION) -> tuple:
+    """
+    Vectorized `grid_cell` with a configurable precision: returns the distinct
+    cells (as a list of latitude-longitude pairs) the given locations fall in,
+    and the position of each location's cell in that list
+    """
+    keys = np.column_stack([np.round(lat, precision), np.round(lon, precision)])
+    cells, inverse = np.unique(keys.astype(np.float64), axis=0, return_inverse=True)
+    return [tuple(cell) for cell in cells.tolist()], inverse.ravel()
+
+
+def get_weather_by_lat_lon(lat, lon, type_="pd") -> pd.DataFrame:
+    """
+    Returns the current weather at the grid cell containing the given
+    latitude-longitude pair
+    """
+    if type_ not in ["dict", "pd", "tuple"]:
+        raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
+
+    lat, lon = grid_cell(lat, lon)
+    record = weather_cache.get_or_compute(
+        ("coords", lat, lon), lambda: _fetch_weather_by_lat_lon(lat, lon)
+    )
+    return _format_weather(record, type_)
 
 
-# @cache_maintainer(3600)  # cache for one hour
-# @lru_cache(maxsize=1000)
 def get_weather_by_zip(zip_code: str, type_="pd") -> pd.DataFrame:
-    """ """
+    """Returns the current weather for the given zip code"""
     if type_ not in ["dict", "pd", "tuple"]:
-        raise ValueError(f"type_ must be either 'pd' or 'dict', not '{type_}'")
+        raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
 
-    weather = owm_mgr.weather_at_zip_code(zip_code, country="US").weather
-    temperature = weather.temperature("fahrenheit")["temp"]
-    humidity = weather.humidity  # in %
-    pressure_conversion = 0.014503773773020924
-    pressure = (
-        weather.barometric_pressure("hPa")["press"] * pressure_conversion
-    )  # in hPa
-    wind_speed = weather.wind("miles_hour")["speed"]  # in mph
-    precipitation = get_rain(weather.rain)  # inches
+    record = weather_cache.get_or_compute(
+        ("zip", zip_code), lambda: _fetch_weather_by_zip(zip_code)
+    )
+    return _format_weather(record, type_)
 
-    if type_ == "pd":
-        columns = [
-            "Temperature(F)",
-            "Humidity(%)",
-            "Pressure(in)",
-            "Wind_Speed(mph)",
-            "Precipitation(in)",
-        ]
-        weather_df = pd.DataFrame(columns=columns, index=[0])
-        weather_df[columns] = temperature, humidity, pressure, wind_speed, precipitation
-        return weather_df
-    elif type_ == "dict":
-        return {
-            "Temperature(F)": temperature,
-            "Humidity(%)": humidity,
-            "Pressure(in)": pressure,
-            "Wind_Speed(mph)": wind_speed,
-            "Precipitation(in)": precipitation,
-        }
-    elif type_ == "tuple":
-        return temperature, humidity, pressure, wind_speed, precipitation
+
+def get_la_weather(type_: str = "pd"):
+    """Returns the next 3-hour forecast for Los Angeles"""
+    if type_ not in ["dict", "pd", "tuple"]:
+        raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
+
+    record = weather_cache.get_or_compute(("city", los_angeles.id), _fetch_la_weather)
+    return _format_weather(record, type_)
 
 
 def get_rain(rain):
@@ -107,44 +124,245 @@ def get_rain(rain):
             precipitation = 0
     return precipitation
 
-# @cache_maintainer(3600)  # cache for one hour
-# @lru_cache(maxsize=1000)
-def get_la_weather(type_: str = "pd"):
-    """"""
-    if type_ not in ["dict", "pd", "tuple"]:
-        raise ValueError(f"type_ must be either 'pd' or 'dict', not '{type_}'")
 
-    weather = (owm_mgr
+class WeatherError(Exception):
+    """Raised when the OpenWeatherMap API can't be reached or returns an error"""
+
+
+class AsyncWeatherClient:
+    """
+    Non-blocking OpenWeatherMap client for use inside the FastAPI handlers. Calls
+    the OWM REST endpoints directly through a shared httpx connection pool and
+    returns the same records as the synchronous functions above (and shares their
+    cache).
+
+    Arguments
+    ---------
+    api_key (str): OpenWeatherMap API key
+    base_url (str): root URL of the OpenWeatherMap API
+    timeout (float): number of seconds to wait for a response
+    max_concurrency (int): maximum number of requests in flight at once
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = OWM_BASE_URL,
+        timeout: float = 5.0,
+        max_concurrency: int = 10,
+    ) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def get_weather_by_lat_lon(self, lat: float, lon: float, type_="pd"):
+        """
+        Returns the current weather at the grid cell containing the given
+        latitude-longitude pair
+        """
+        if type_ not in ["dict", "pd", "tuple"]:
+            raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
+
+        lat, lon = grid_cell(lat, lon)
+        # the current weather endpoint, as One Call 3.0 needs its own subscription
+        params = {"lat": lat, "lon": lon}
+        record = await weather_cache.aget_or_compute(
+            ("coords", lat, lon),
+            lambda: self._fetch("/data/2.5/weather", params, _parse_weather),
+        )
+        return _format_weather(record, type_)
+
+    async def get_weather_by_zip(self, zip_code: str, type_="pd"):
+        """Returns the current weather for the given zip code"""
+        if type_ not in ["dict", "pd", "tuple"]:
+            raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
+
+        params = {"zip": f"{zip_code},US"}
+        record = await weather_cache.aget_or_compute(
+            ("zip", zip_code),
+            lambda: self._fetch("/data/2.5/weather", params, _parse_weather),
+        )
+        return _format_weather(record, type_)
+
+    async def get_la_weather(self, type_: str = "pd"):
+        """Returns the next 3-hour forecast for Los Angeles"""
+        if type_ not in ["dict", "pd", "tuple"]:
+            raise ValueError(f"type_ must be either 'pd', 'dict' or 'tuple', not '{type_}'")
+
+        params = {"id": los_angeles.id, "cnt": 1}
+        record = await weather_cache.aget_or_compute(
+            ("city", los_angeles.id),
+            lambda: self._fetch("/data/2.5/forecast", params, _parse_forecast),
+        )
+        return _format_weather(record, type_)
+
+    async def get_forecast(
+        self, lat: float = None, lon: float = None, zip_code: str = None, steps: int = 8
+    ) -> tuple:
+        """
+        Returns the next `steps` 3-hour forecast steps (at most 40, i.e. 5 days) for
+        the given zip code, or for the grid cell containing the given
+        latitude-longitude pair
+
+        Returns
+        -------
+        (tuple) datetime64 array of the local time of each step and an array with
+        one row of weather values (in `COLUMNS` order) per step
+        """
+        if zip_code is not None:
+            key, params = ("zip", zip_code), {"zip": f"{zip_code},US"}
+        else:
+            lat, lon = grid_cell(lat, lon)
+            key, params = ("coords", lat, lon), {"lat": lat, "lon": lon}
+        return await weather_cache.aget_or_compute(
+            ("forecast", *key, steps),
+            lambda: self._fetch(
+                "/data/2.5/forecast", {**params, "cnt": steps}, _parse_forecast_steps
+            ),
+        )
+
+    async def get_weather_by_zips(self, zip_codes: list) -> dict:
+        """
+        Fetches the weather for many zip codes concurrently (at most
+        `max_concurrency` requests at a time). Returns a dict of zip code to weather
+        tuple, leaving out zip codes whose weather couldn't be fetched.
+        """
+        results = await asyncio.gather(
+            *(self.get_weather_by_zip(zc, type_="tuple") for zc in zip_codes),
+            return_exceptions=True,
+        )
+        return {
+            zc: weather
+            for zc, weather in zip(zip_codes, results)
+            if not isinstance(weather, BaseException)
+        }
+
+    async def get_weather_by_cells(self, cells: list) -> dict:
+        """
+        Same as `get_weather_by_zips`, for a list of latitude-longitude pairs (e.g.
+        from `grid_cells`)
+        """
+        results = await asyncio.gather(
+            *(self.get_weather_by_lat_lon(lat, lon, type_="tuple") for lat, lon in cells),
+            return_exceptions=True,
+        )
+        return {
+            cell: weather
+            for cell, weather in zip(cells, results)
+            if not isinstance(weather, BaseException)
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch(self, path: str, params: dict, parse) -> tuple:
+        if self._client is None:
+            # created lazily so the pool and semaphore belong to the running loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            try:
+                with metrics.span("weather"):
+                    response = await self._client.get(
+                        path, params={**params, "appid": self.api_key}
+                    )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                raise WeatherError(f"OpenWeatherMap request to {path} failed: {e}") from e
+        return parse(response.json())
+
+
+async_client = AsyncWeatherClient(
+    os.environ.get("OWM_API_KEY"),
+    timeout=float(os.environ.get("OWM_TIMEOUT", 5.0)),
+    max_concurrency=int(os.environ.get("OWM_MAX_CONCURRENCY", 10)),
+)
+
+
+@metrics.timed("weather")
+def _fetch_weather_by_lat_lon(lat: float, lon: float) -> tuple:
+    weather = weather_manager().one_call(lat=lat, lon=lon).current
+    return _to_record(weather, weather.temperature("fahrenheit")["temp"])
+
+
+@metrics.timed("weather")
+def _fetch_weather_by_zip(zip_code: str) -> tuple:
+    weather = weather_manager().weather_at_zip_code(zip_code, country="US").weather
+    return _to_record(weather, weather.temperature("fahrenheit")["temp"])
+
+
+@metrics.timed("weather")
+def _fetch_la_weather() -> tuple:
+    weather = (weather_manager()
         .forecast_at_id(los_angeles.id, interval="3h", limit=1)
         .forecast
         .weathers[0])
-    temperature = weather.temperature("fahrenheit")["temp"]
+    return _to_record(weather, weather.temperature("fahrenheit")["temp"])
+
+
+def _to_record(weather, temperature: float) -> tuple:
+    """
+    Converts a pyowm Weather object to a (temperature, humidity, pressure, wind
+    speed, precipitation) tuple in the units used by the model
+    """
     humidity = weather.humidity  # in %
-    pressure_conversion = 0.014503773773020924
     pressure = (
-        weather.barometric_pressure("hPa")["press"] * pressure_conversion
+        weather.barometric_pressure("hPa")["press"] * PRESSURE_CONVERSION
     )  # in hPa
     wind_speed = weather.wind("miles_hour")["speed"]  # in mph
     precipitation = get_rain(weather.rain)  # inches
+    return temperature, humidity, pressure, wind_speed, precipitation
+
 
+def _parse_weather(data: dict) -> tuple:
+    """
+    Converts a current weather or forecast step JSON object from the OWM REST API
+    (standard units) to the same record `_to_record` returns
+    """
+    main = data["main"]
+    return (
+        _kelvin_to_fahrenheit(main["temp"]),
+        main["humidity"],
+        main["pressure"] * PRESSURE_CONVERSION,
+        data.get("wind", {}).get("speed", 0) * MPH_PER_METER_SEC,
+        get_rain(data.get("rain") or {}),
+    )
+
+
+def _parse_forecast(data: dict) -> tuple:
+    return _parse_weather(data["list"][0])
+
+
+def _parse_forecast_steps(data: dict) -> tuple:
+    # `dt` is in UTC, the model was trained on local times
+    offset = data.get("city", {}).get("timezone", 0)
+    times = np.array([step["dt"] + offset for step in data["list"]], dtype="datetime64[s]")
+    weather = np.array([_parse_weather(step) for step in data["list"]], dtype=np.float64)
+    times.setflags(write=False)  # shared through the cache
+    weather.setflags(write=False)
+    return times, weather.reshape(len(times), len(COLUMNS))
+
+
+def _kelvin_to_fahrenheit(temperature: float) -> float:
+    # rounded the same way pyowm does
+    return round((temperature - KELVIN_OFFSET) * 1.8 + 32, 2)
+
+
+def _format_weather(record: tuple, type_: str):
     if type_ == "pd":
-        columns = [
-            "Temperature(F)",
-            "Humidity(%)",
-            "Pressure(in)",
-            "Wind_Speed(mph)",
-            "Precipitation(in)",
-        ]
-        weather_df = pd.DataFrame(columns=columns, index=[0])
-        weather_df[columns] = temperature, humidity, pressure, wind_speed, precipitation
+        weather_df = pd.DataFrame(columns=COLUMNS, index=[0])
+        weather_df[COLUMNS] = record
         return weather_df
     elif type_ == "dict":
-        return {
-            "Temperature(F)": temperature,
-            "Humidity(%)": humidity,
-            "Pressure(in)": pressure,
-            "Wind_Speed(mph)": wind_speed,
-            "Precipitation(in)": precipitation,
-        }
+        return dict(zip(COLUMNS, record))
     elif type_ == "tuple":
-        return temperature, humidity, pressure, wind_speed, precipitation
+        return record